@@ -0,0 +1,210 @@
+import argparse
+import contextlib
+import functools
+import json
+import os
+import platform
+import re
+import resource
+import subprocess
+import sys
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import get_context
+from types import SimpleNamespace
+
+import pandas as pd
+
+sys.setrecursionlimit(3000)
+sys.path.append('../')
+
+from logparser.AdaParser import LogParser
+from logparser.AdaParser.log import configure_logging
+
+datasets = [
+    "Hadoop",
+    "HDFS",
+    "OpenStack",
+    "Spark",
+    "Zookeeper",
+    "BGL",
+    "HPC",
+    "Thunderbird",
+    "Linux",
+    "Mac",
+    "Apache",
+    "OpenSSH",
+    "HealthApp",
+    "Proxifier"
+]
+
+
+class ReplayClient:
+    """A deterministic stand-in for the OpenAI client that answers with the groundtruth template of the queried log."""
+
+    def __init__(self, groundtruth_path, timer=None):
+        df = pd.read_csv(groundtruth_path, usecols=['Content', 'EventTemplate'], dtype=str, keep_default_na=False)
+        self.templates = dict(zip(df['Content'].str.strip(), df['EventTemplate'].str.replace("<*>", "{variables}", regex=False)))
+        self.timer = timer
+        self.calls = 0
+        self.chat = SimpleNamespace(completions=SimpleNamespace(create=self.create))
+
+    def create(self, model, messages, temperature=0.0, seed=None, **kwargs):
+        with self.timer.stage("llm") if self.timer is not None else contextlib.nullcontext():
+            self.calls += 1
+            if messages[-1]["content"].startswith("Log messages:"):
+                # a batch prompt: answer every numbered log message
+                lines = re.findall(r"^(\d+)\. `(.*)`$", messages[-1]["content"], re.M)
+                content = "\n".join(f"{i}. `{self.templates.get(logMessage, logMessage)}`" for i, logMessage in lines)
+                return self.response(messages, content)
+            # refinement prompts come after the log message, so the last one is the queried log
+            logMessage = next(m["content"] for m in reversed(messages)
+                              if m["role"] == "user" and m["content"].startswith("Log message: `"))
+            logMessage = logMessage[len("Log message: `"):-1]
+            template = self.templates.get(logMessage, logMessage)
+            return self.response(messages, f"Log template: `{template}`")
+
+    @staticmethod
+    def response(messages, content):
+        usage = SimpleNamespace(prompt_tokens=sum(len(m["content"]) for m in messages) // 4,
+                                completion_tokens=len(content) // 4)
+        return SimpleNamespace(usage=usage, choices=[SimpleNamespace(message=SimpleNamespace(content=content))])
+
+
+class StageTimer:
+    """Accumulates the exclusive wall time of nested stages: time spent in an inner stage is not counted in the outer one."""
+
+    def __init__(self):
+        self.seconds = {}
+        self.calls = {}
+        self.local = threading.local()
+
+    @contextlib.contextmanager
+    def stage(self, name):
+        stack = self.local.__dict__.setdefault("stack", [])
+        stack.append(0.0)
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - start
+            inner = stack.pop()
+            if stack:
+                stack[-1] += elapsed
+            self.seconds[name] = self.seconds.get(name, 0.0) + elapsed - inner
+            self.calls[name] = self.calls.get(name, 0) + 1
+
+    def wrap(self, obj, method, name):
+        function = getattr(obj, method)
+
+        @functools.wraps(function)
+        def timed(*args, **kwargs):
+            with self.stage(name):
+                return function(*args, **kwargs)
+
+        setattr(obj, method, timed)
+
+
+def instrument(parser, timer):
+    timer.wrap(parser.trie, "search", "search")
+    timer.wrap(parser, "example_select", "example_selection")
+    timer.wrap(parser, "query_template", "post_processing")
+    timer.wrap(parser.trie, "update", "merge")
+    timer.wrap(parser, "load_data", "load")
+    timer.wrap(parser, "outputResult", "output")
+    timer.wrap(parser, "outputStream", "output")
+    timer.wrap(parser, "save_snapshot", "snapshot")
+
+
+def benchmark_dataset(dataset, args, input_dir, output_dir):
+    log_file = f"{dataset}/{dataset}_full.log"
+    indir = os.path.join(input_dir, dataset)
+    groundtruth = os.path.join(input_dir, log_file + '_structured.csv')
+    timer = StageTimer()
+    client = ReplayClient(groundtruth, timer)
+    parser = LogParser(indir=indir, outdir=os.path.join(output_dir, dataset), model=args.model, log_ratio=args.log_ratio,
+                       query_window=args.query_window, concurrency=args.concurrency, batch_size=args.batch_size, precluster=args.precluster, client=client,
+                       chunk_size=args.chunk_size, compact_trie=args.compact_trie)
+    instrument(parser, timer)
+
+    configure_logging("WARNING")
+    start = time.perf_counter()
+    parser.parse(os.path.basename(log_file))
+    parse_time = time.perf_counter() - start
+
+    if parser.df_log is not None:
+        lines = parser.df_log.shape[0]
+    else:
+        lines = sum(len(chunk) for chunk in parser.load_chunks(os.path.join(indir, os.path.basename(log_file))))
+    stages = {name: round(seconds, 4) for name, seconds in sorted(timer.seconds.items())}
+    stages["other"] = round(parse_time - sum(timer.seconds.values()), 4)
+    return {
+        "dataset": dataset,
+        "lines": lines,
+        "parse_time": round(parse_time, 4),
+        "lines_per_second": round(lines / parse_time, 1),
+        "stage_seconds": stages,
+        "stage_calls": dict(sorted(timer.calls.items())),
+        "peak_memory_mb": round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+        "llm_calls": client.calls,
+        "queries": parser.query_num,
+        "prompt_tokens": parser.total_prompt_tokens,
+        "completion_tokens": parser.total_completion_tokens,
+        "templates": sum(1 for _ in parser.trie.nodes())
+    }
+
+
+def git_revision():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "HEAD"], stderr=subprocess.DEVNULL, text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Measure AdaParser throughput with an LLM stub that replays the groundtruth templates.")
+    parser.add_argument('--datasets', type=str, nargs='*',
+                        default=datasets)
+    parser.add_argument('--model', type=str,
+                        default="gpt-3.5-turbo-0125")
+    parser.add_argument('--log_ratio', type=str,
+                        default="20")
+    parser.add_argument('--query_window', type=int,
+                        default=0)
+    parser.add_argument('--concurrency', type=int,
+                        default=1)
+    parser.add_argument('--batch_size', type=int,
+                        default=1)
+    parser.add_argument('--chunk_size', type=int,
+                        default=None)
+    parser.add_argument('--precluster', action='store_true')
+    parser.add_argument('--compact_trie', action='store_true')
+    parser.add_argument('--output', type=str,
+                        default="../../result/benchmark_AdaParser.json")
+    args = parser.parse_args()
+
+    input_dir = f"../../full_dataset/"
+    output_dir = f"../../result/result_AdaParser_benchmark"
+
+    results = []
+    for dataset in args.datasets:
+        # a fresh process per dataset, so the peak memory is that of the dataset alone
+        with ProcessPoolExecutor(max_workers=1, mp_context=get_context("spawn")) as executor:
+            result = executor.submit(benchmark_dataset, dataset, args, input_dir, output_dir).result()
+        print(f"{dataset}: {result['lines_per_second']} lines/s, {result['parse_time']}s, "
+              f"{result['peak_memory_mb']} MB, {result['llm_calls']} LLM calls")
+        results.append(result)
+
+    report = {
+        "revision": git_revision(),
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "python": platform.python_version(),
+        "params": vars(args),
+        "results": results
+    }
+    directory = os.path.dirname(args.output)
+    if directory and not os.path.exists(directory):
+        os.makedirs(directory)
+    with open(args.output, 'w') as fw:
+        json.dump(report, fw, indent=2)
@@ -15,11 +15,13 @@ Copyright (C) 2022 University of Luxembourg
 import argparse
 import sys
 import os
+from concurrent.futures import ProcessPoolExecutor
 
 sys.setrecursionlimit(3000)
 sys.path.append('../')
 
 from logparser.AdaParser import LogParser
+from logparser.AdaParser.log import configure_logging
 from evaluation.utils.evaluator_main import evaluator, prepare_results
 from evaluation.utils.postprocess import post_average
 
@@ -40,13 +42,81 @@ datasets = [
     "Proxifier"
 ]
 
+
+def evaluate_dataset(dataset, args, input_dir, output_dir, result_file):
+    log_file = f"{dataset}/{dataset}_full.log"
+    indir = os.path.join(input_dir, os.path.dirname(log_file))
+    snapshot = None
+    if args.snapshot_dir is not None:
+        snapshot = os.path.join(args.snapshot_dir, f"{dataset}_full.log_snapshot.json.gz")
+        if not os.path.exists(snapshot):
+            snapshot = None
+    if os.path.exists(os.path.join(output_dir, f"{dataset}_full.log_structured.csv")):
+        parser = None
+        print("parseing result exist.")
+    else:
+        parser = LogParser
+    # run evaluator for a dataset
+    evaluator(
+        dataset=dataset,
+        input_dir=input_dir,
+        output_dir=output_dir,
+        log_file=log_file,
+        LogParser=parser,
+        param_dict={
+            'indir': indir, 'outdir': output_dir, 'model': args.model, 'log_ratio': args.log_ratio,
+            'query_window': args.query_window, 'concurrency': args.concurrency, 'cache_path': args.cache_path,
+            'chunk_size': args.chunk_size, 'snapshot': snapshot, 'shards': args.shards,
+            'compact_trie': args.compact_trie, 'output_formats': args.output_formats,
+            'metrics_format': args.metrics_format, 'merge_index': args.merge_index,
+            'batch_size': args.batch_size, 'precluster': args.precluster,
+            'requests_per_minute': args.requests_per_minute, 'tokens_per_minute': args.tokens_per_minute
+        },
+        result_file=result_file
+    )  # it internally saves the results into a summary file
+
+
 if __name__ == "__main__":
     parser = argparse.ArgumentParser()
     parser.add_argument('--model', type=str,
                         default="gpt-3.5-turbo-0125")
     parser.add_argument('--log_ratio', type=str,
                         default="20")
+    parser.add_argument('--query_window', type=int,
+                        default=0)
+    parser.add_argument('--concurrency', type=int,
+                        default=1)
+    parser.add_argument('--cache_path', type=str,
+                        default="../../result/llm_cache.sqlite")
+    parser.add_argument('--chunk_size', type=int,
+                        default=None)
+    parser.add_argument('--snapshot_dir', type=str,
+                        default=None)
+    parser.add_argument('--workers', type=int,
+                        default=1)
+    parser.add_argument('--shards', type=int,
+                        default=1)
+    parser.add_argument('--requests_per_minute', type=float,
+                        default=None)
+    parser.add_argument('--tokens_per_minute', type=float,
+                        default=None)
+    parser.add_argument('--batch_size', type=int,
+                        default=1)
+    parser.add_argument('--precluster', action='store_true')
+    parser.add_argument('--compact_trie', action='store_true')
+    parser.add_argument('--merge_index', action='store_true')
+    parser.add_argument('--output_formats', type=str, nargs='*', choices=['parquet', 'feather'],
+                        default=[])
+    parser.add_argument('--metrics_format', type=str, choices=['json', 'prometheus'],
+                        default=None)
+    parser.add_argument('--log_level', type=str, choices=['DEBUG', 'INFO', 'WARNING', 'ERROR'],
+                        default="INFO")
+    parser.add_argument('--log_format', type=str, choices=['text', 'json'],
+                        default="text")
+    parser.add_argument('--log_rate', type=float,
+                        default=None, help="at most this many records per second of each per-line event")
     args = parser.parse_args()
+    configure_logging(args.log_level, args.log_format == 'json', args.log_rate)
 
     input_dir = f"../../full_dataset/"
     output_dir = f"../../result/result_AdaParser_full"
@@ -57,25 +127,13 @@ if __name__ == "__main__":
         output_dir=output_dir
     )
 
-    for dataset in datasets:
-        log_file = f"{dataset}/{dataset}_full.log"
-        indir = os.path.join(input_dir, os.path.dirname(log_file))
-        if os.path.exists(os.path.join(output_dir, f"{dataset}_full.log_structured.csv")):
-            parser = None
-            print("parseing result exist.")
-        else:
-            parser = LogParser
-        # run evaluator for a dataset
-        evaluator(
-            dataset=dataset,
-            input_dir=input_dir,
-            output_dir=output_dir,
-            log_file=log_file,
-            LogParser=parser,
-            param_dict={
-                'indir': indir, 'outdir': output_dir, 'model': args.model, 'log_ratio': args.log_ratio
-            },
-            result_file=result_file
-        )  # it internally saves the results into a summary file
+    if args.workers > 1:
+        with ProcessPoolExecutor(max_workers=args.workers) as executor:
+            futures = [executor.submit(evaluate_dataset, dataset, args, input_dir, output_dir, result_file) for dataset in datasets]
+            for future in futures:
+                future.result()
+    else:
+        for dataset in datasets:
+            evaluate_dataset(dataset, args, input_dir, output_dir, result_file)
     metric_file = os.path.join(output_dir, result_file)
     post_average(metric_file, "AdaParser")
@@ -0,0 +1,53 @@
+import argparse
+import sys
+
+sys.setrecursionlimit(3000)
+sys.path.append('../')
+
+from logparser.AdaParser import LogParser
+from logparser.AdaParser.log import configure_logging
+from logparser.AdaParser.online import OnlineParser, follow, serve
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Parse log lines online from stdin, a followed file or a local socket.")
+    parser.add_argument('--dataset', type=str, required=True,
+                        help="dataset whose sampled examples seed the trie")
+    parser.add_argument('--model', type=str,
+                        default="gpt-3.5-turbo-0125")
+    parser.add_argument('--log_ratio', type=str,
+                        default="20")
+    parser.add_argument('--requests_per_minute', type=float,
+                        default=None)
+    parser.add_argument('--tokens_per_minute', type=float,
+                        default=None)
+    parser.add_argument('--cache_path', type=str,
+                        default="../../result/llm_cache.sqlite")
+    parser.add_argument('--snapshot', type=str,
+                        default=None, help="warm-start from a trie snapshot saved by a previous run")
+    parser.add_argument('--follow', type=str,
+                        default=None, help="follow a file that is being appended to")
+    parser.add_argument('--from_start', action='store_true',
+                        help="with --follow, parse the existing content first")
+    parser.add_argument('--port', type=int,
+                        default=None, help="serve on 127.0.0.1:PORT instead of reading stdin")
+    parser.add_argument('--log_level', type=str, choices=['DEBUG', 'INFO', 'WARNING', 'ERROR'],
+                        default="INFO")
+    parser.add_argument('--log_format', type=str, choices=['text', 'json'],
+                        default="text")
+    parser.add_argument('--log_rate', type=float,
+                        default=None, help="at most this many records per second of each per-line event")
+    args = parser.parse_args()
+
+    # diagnostics of the parser go to stderr so stdout only carries records
+    configure_logging(args.log_level, args.log_format == 'json', args.log_rate)
+    log_parser = LogParser(indir=None, outdir=None, model=args.model, log_ratio=args.log_ratio, cache_path=args.cache_path,
+                           snapshot=args.snapshot, requests_per_minute=args.requests_per_minute,
+                           tokens_per_minute=args.tokens_per_minute)
+    output = sys.stdout
+    online_parser = OnlineParser(log_parser, args.dataset)
+    if args.port is not None:
+        serve(online_parser, port=args.port)
+    elif args.follow is not None:
+        online_parser.parse_stream(follow(args.follow, from_start=args.from_start), output)
+    else:
+        online_parser.parse_stream(sys.stdin, output)
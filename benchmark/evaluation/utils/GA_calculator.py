@@ -10,7 +10,8 @@ try:
     from scipy.misc import comb
 except ImportError as e:
     from scipy.special import comb
-from tqdm import tqdm
+
+from evaluation.utils.group_statistics import GroupStatistics
 
 
 def calculate_group_accuracy(df_groundtruth, df_parsedlog, filter_templates=None):
@@ -58,48 +59,4 @@ def get_accuracy(series_groundtruth, series_parsedlog, filter_templates=None):
         f_measure : float
         accuracy : float
     """
-    series_groundtruth_valuecounts = series_groundtruth.value_counts()
-    series_parsedlog_valuecounts = series_parsedlog.value_counts()
-    df_combined = pd.concat([series_groundtruth, series_parsedlog], axis=1, keys=['groundtruth', 'parsedlog'])
-    grouped_df = df_combined.groupby('groundtruth')
-    accurate_events = 0  # determine how many lines are correctly parsed
-    accurate_templates = 0
-    if filter_templates is not None:
-        filter_identify_templates = set()
-    # for ground_truthId in tqdm(series_groundtruth_valuecounts.index):
-    for ground_truthId, group in tqdm(grouped_df):
-        # logIds = series_groundtruth[series_groundtruth == ground_truthId].index
-        series_parsedlog_logId_valuecounts = group['parsedlog'].value_counts()
-        if filter_templates is not None and ground_truthId in filter_templates:
-            for parsed_eventId in series_parsedlog_logId_valuecounts.index:
-                filter_identify_templates.add(parsed_eventId)
-        if series_parsedlog_logId_valuecounts.size == 1:
-            parsed_eventId = series_parsedlog_logId_valuecounts.index[0]
-            if len(group) == series_parsedlog[series_parsedlog == parsed_eventId].size:
-                if (filter_templates is None) or (ground_truthId in filter_templates):
-                    accurate_events += len(group)
-                    accurate_templates += 1
-    # print("filter templates: ", len(filter_templates))
-    # print("total messages: ", len(series_groundtruth[series_groundtruth.isin(filter_templates)]))
-    # print("set of total: ", len(filter_identify_templates))
-    # print(accurate_events, accurate_templates)
-    if filter_templates is not None:
-        GA = float(accurate_events) / len(series_groundtruth[series_groundtruth.isin(filter_templates)])
-        PGA = float(accurate_templates) / len(filter_identify_templates)
-        RGA = float(accurate_templates) / len(filter_templates)
-    else:
-        GA = float(accurate_events) / len(series_groundtruth)
-        PGA = float(accurate_templates) / len(series_parsedlog_valuecounts)
-        RGA = float(accurate_templates) / len(series_groundtruth_valuecounts)
-    # print(FGA, RGA)
-    FGA = 0.0
-    if PGA != 0 or RGA != 0:
-        FGA = 2 * (PGA * RGA) / (PGA + RGA)
-    return GA, FGA
-
-
-
-
-
-
-
+    return GroupStatistics(series_groundtruth, series_parsedlog).grouping(filter_templates)
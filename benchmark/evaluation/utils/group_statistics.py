@@ -0,0 +1,84 @@
+import numpy as np
+import pandas as pd
+
+
+class GroupStatistics:
+    """Groundtruth and parsed templates of the same log lines, factorized to integer codes.
+
+    Every grouping metric is derived from the distinct (groundtruth, parsed)
+    pairs and the per-code counts, in a few NumPy operations instead of one
+    scan of the log per group. Missing values get code -1 and, like in a
+    pandas groupby or value_counts, belong to no group.
+    """
+
+    def __init__(self, series_groundtruth, series_parsedlog):
+        self.groundtruth_codes, groundtruth_templates = pd.factorize(series_groundtruth)
+        self.parsed_codes, parsed_templates = pd.factorize(series_parsedlog)
+        self.groundtruth_templates = np.asarray(groundtruth_templates, dtype=object)
+        self.parsed_templates = np.asarray(parsed_templates, dtype=object)
+        self.groundtruth_counts = np.bincount(self.groundtruth_codes[self.groundtruth_codes >= 0],
+                                              minlength=len(self.groundtruth_templates))
+        self.parsed_counts = np.bincount(self.parsed_codes[self.parsed_codes >= 0],
+                                         minlength=len(self.parsed_templates))
+        valid = (self.groundtruth_codes >= 0) & (self.parsed_codes >= 0)
+        pair_codes = (self.groundtruth_codes[valid].astype(np.int64) * len(self.parsed_templates)
+                      + self.parsed_codes[valid])
+        pair_codes = np.unique(pair_codes)
+        self.pair_groundtruth = pair_codes // max(len(self.parsed_templates), 1)
+        self.pair_parsed = pair_codes % max(len(self.parsed_templates), 1)
+
+    def groundtruth_in(self, templates):
+        return np.asarray(pd.Index(self.groundtruth_templates).isin(list(templates)))
+
+    def parsed_in(self, templates):
+        return np.asarray(pd.Index(self.parsed_templates).isin(list(templates)))
+
+    @staticmethod
+    def single_partner(codes, partners, size):
+        """For each code, its only partner code, or -1 when it has none or several."""
+        partner_counts = np.bincount(codes, minlength=size)
+        single = np.full(size, -1, dtype=np.int64)
+        unique = partner_counts[codes] == 1
+        single[codes[unique]] = partners[unique]
+        return single
+
+    def grouping(self, filter_templates=None):
+        """GA and FGA: a groundtruth group is accurate when it is exactly one parsed group."""
+        parsed = self.single_partner(self.pair_groundtruth, self.pair_parsed, len(self.groundtruth_templates))
+        accurate = parsed >= 0
+        accurate[accurate] = self.groundtruth_counts[accurate] == self.parsed_counts[parsed[accurate]]
+        if filter_templates is not None:
+            kept = self.groundtruth_in(filter_templates)
+            accurate &= kept
+            identified = len(np.unique(self.pair_parsed[kept[self.pair_groundtruth]]))
+            total_events = int(self.groundtruth_counts[kept].sum())
+            total_templates = len(filter_templates)
+        else:
+            identified = len(self.parsed_templates)
+            total_events = len(self.groundtruth_codes)
+            total_templates = len(self.groundtruth_templates)
+        accurate_events = int(self.groundtruth_counts[accurate].sum())
+        accurate_templates = int(accurate.sum())
+
+        GA = float(accurate_events) / total_events
+        PGA = float(accurate_templates) / identified
+        RGA = float(accurate_templates) / total_templates
+        FGA = 0.0
+        if PGA != 0 or RGA != 0:
+            FGA = 2 * (PGA * RGA) / (PGA + RGA)
+        return GA, FGA
+
+    def template_level(self, filter_templates=None):
+        """Identified and groundtruth template numbers, and the parsed templates that are exactly one groundtruth group."""
+        groundtruth = self.single_partner(self.pair_parsed, self.pair_groundtruth, len(self.parsed_templates))
+        correct = groundtruth >= 0
+        correct[correct] = self.groundtruth_templates[groundtruth[correct]] == self.parsed_templates[correct]
+        if filter_templates is not None:
+            correct &= self.parsed_in(filter_templates)
+            kept = self.groundtruth_in(filter_templates)
+            identified = len(np.unique(self.pair_parsed[kept[self.pair_groundtruth]]))
+            total_templates = len(filter_templates)
+        else:
+            identified = len(self.parsed_templates)
+            total_templates = len(self.groundtruth_templates)
+        return identified, total_templates, int(correct.sum())
@@ -15,8 +15,7 @@ Copyright (C) 2022 University of Luxembourg
 
 from __future__ import print_function
 
-import pandas as pd
-from tqdm import tqdm
+from evaluation.utils.group_statistics import GroupStatistics
 
 
 def evaluate_template_level(dataset, df_groundtruth, df_parsedresult, filter_templates=None):
@@ -30,39 +29,17 @@ def evaluate_template_level(dataset, df_groundtruth, df_parsedresult, filter_tem
     :return: SM, OG, UG, MX
     """
 
-    correct_parsing_templates = 0
-    if filter_templates is not None:
-        filter_identify_templates = set()
     null_logids = df_groundtruth[~df_groundtruth['EventTemplate'].isnull()].index
     df_groundtruth = df_groundtruth.loc[null_logids]
     df_parsedresult = df_parsedresult.loc[null_logids]
-    series_groundtruth = df_groundtruth['EventTemplate']
-    series_parsedlog = df_parsedresult['EventTemplate']
-    series_groundtruth_valuecounts = series_groundtruth.value_counts()
+    statistics = GroupStatistics(df_groundtruth['EventTemplate'], df_parsedresult['EventTemplate'])
+    t1, t2, correct_parsing_templates = statistics.template_level(filter_templates)
 
-    df_combined = pd.concat([series_groundtruth, series_parsedlog], axis=1, keys=['groundtruth', 'parsedlog'])
-    grouped_df = df_combined.groupby('parsedlog')
-    
-    for identified_template, group in tqdm(grouped_df):
-        corr_oracle_templates = set(list(group['groundtruth']))
-        if filter_templates is not None and len(corr_oracle_templates.intersection(set(filter_templates))) > 0:
-            filter_identify_templates.add(identified_template)
-        
-        if corr_oracle_templates == {identified_template}:
-            if (filter_templates is None) or (identified_template in filter_templates):
-                correct_parsing_templates += 1
-
-    if filter_templates is not None:
-        PTA = correct_parsing_templates / len(filter_identify_templates)
-        RTA = correct_parsing_templates / len(filter_templates)
-    else:
-        PTA = correct_parsing_templates / len(grouped_df)
-        RTA = correct_parsing_templates / len(series_groundtruth_valuecounts)
+    PTA = correct_parsing_templates / t1
+    RTA = correct_parsing_templates / t2
     FTA = 0.0
     if PTA != 0 or RTA != 0:
         FTA = 2 * (PTA * RTA) / (PTA + RTA)
     print('PTA: {:.4f}, RTA: {:.4f} FTA: {:.4f}'.format(PTA, RTA, FTA))
-    t1 = len(grouped_df) if filter_templates is None else len(filter_identify_templates)
-    t2 = len(series_groundtruth_valuecounts) if filter_templates is None else len(filter_templates)
     print("Identify : {}, Groundtruth : {}".format(t1, t2))
     return t1, t2, FTA, PTA, RTA
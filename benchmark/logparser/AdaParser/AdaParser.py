@@ -1,14 +1,30 @@
+import gzip
 import hashlib
+import itertools
+import json
+import logging
 import os
+import threading
+import zlib
+from collections import OrderedDict, defaultdict
 
-import pandas as pd
 import regex as re
 
-from .Trie import Trie
-from .utils import gpt_call, read_json_file, LCS_similarity, is_datetime_string, post_process_template
+from .Trie import CompactTrie, Trie
+from .candidate_index import CandidateIndex
+from .constants import assignment_spans, follows_assignment, is_datetime_string
+from .llm_client import LLMCallError, RateLimiter
+from .metrics import Metrics, timed
+from .preclustering import PreClusterer
+from .response_cache import ResponseCache
+from .scheduler import QueryScheduler
+from .utils import gpt_call, read_json_file, message_split, post_process_template, root_dir
+
+logger = logging.getLogger(__name__)
 
 parsing_prompt = "I want you to act like an expert of log parsing. I will give you a log message delimited by backticks. You must identify and abstract all the dynamic variables in logs with {variables} and output a static log template. Print the input log's template delimited by backticks."
 constant_refine_prompt = '''The token {} may not be dynamic variables and do not need to be abstracted. Please provide a revised log template.'''
+batch_parsing_prompt = "I want you to act like an expert of log parsing. I will give you numbered log messages, each delimited by backticks. For each log message, you must identify and abstract all the dynamic variables with {variables} and output a static log template. Print one line per log message: its number followed by its template delimited by backticks."
 post_refine_prompt = "The log template can not match the log message via regular expression. There may extra {{variables}}, punctuations or spaces. If there are typos, do not fix it. Please provide a revised log template."
 
 pattern1 = re.compile(r"\{\w+}")
@@ -16,23 +32,120 @@ pattern2 = re.compile(r"[^ ]+")
 pattern3 = re.compile(r"^[A-Za-z\s/]*$")
 pattern4 = re.compile(r"(.*?:)")
 pattern5 = re.compile(r"/(<\*>|\w)+/?")
+batch_answer_pattern = re.compile(r"^\s*(\d+)\s*[.:)]\s*(.*)$", re.M)
+
+
+class TemplateRegexCache:
+    """LRU cache of compiled template regexes, keyed by template text and wildcard expression."""
+
+    def __init__(self, maxsize=1024):
+        self.maxsize = maxsize
+        self.cache = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+
+    def get(self, template, wildcard):
+        key = (template, wildcard)
+        with self.lock:
+            rex = self.cache.get(key)
+            if rex is not None:
+                self.hits += 1
+                self.cache.move_to_end(key)
+                return rex
+            self.misses += 1
+        rex = pattern1.sub("WILDCARD", template)
+        rex = pattern2.sub(lambda x: re.escape(x.group(0)), rex)
+        rex = re.compile(rex.replace("WILDCARD", wildcard))
+        with self.lock:
+            self.cache[key] = rex
+            if len(self.cache) > self.maxsize:
+                self.cache.popitem(last=False)
+        return rex
 
 
 class LogParser:
-    def __init__(self, indir, outdir, model, log_ratio):
+    def __init__(self, indir, outdir, model, log_ratio, template_cache_size=1024, query_window=0, concurrency=1, client=None,
+                 cache_path=None, chunk_size=None, snapshot=None, shards=1, compact_trie=False,
+                 output_formats=(), metrics=None, metrics_format=None, examples_dir=None,
+                 merge_index=False, batch_size=1, precluster=False, requests_per_minute=None, tokens_per_minute=None):
         self.indir = indir
         self.outdir = outdir
         self.model = model
         self.log_ratio = log_ratio
         self.df_log = None
-        self.trie = Trie()
+        self.metrics = metrics if metrics is not None else Metrics()
+        self.metrics_format = metrics_format
+        self.trie = (CompactTrie if compact_trie else Trie)(self.metrics, merge_index)
+        self.similarity = self.trie.similarity
+        self.template_cache = TemplateRegexCache(template_cache_size)
+        self.query_window = query_window
+        self.concurrency = concurrency
+        self.batch_size = batch_size
+        self.precluster = precluster
+        self.client = client
+        self.requests_per_minute = requests_per_minute
+        self.tokens_per_minute = tokens_per_minute
+        self.rate_limiter = RateLimiter(requests_per_minute, tokens_per_minute) if requests_per_minute or tokens_per_minute else None
+        self.cache = ResponseCache(cache_path) if cache_path else None
+        self.chunk_size = chunk_size
+        self.snapshot = snapshot
+        self.shards = shards
+        self.output_formats = output_formats
+        self.examples_dir = examples_dir if examples_dir is not None else os.path.join(root_dir, "full_dataset")
+        self.query_num = 0
+        self.lock = threading.Lock()
         self.total_prompt_tokens = 0
         self.total_completion_tokens = 0
 
+    def query_llm(self, messages, temperature):
+        response, prompt_tokens, completion_tokens = gpt_call(messages, model=self.model, temperature=temperature,
+                                                              client=self.client, cache=self.cache,
+                                                              rate_limiter=self.rate_limiter)
+        with self.lock:
+            self.total_prompt_tokens += prompt_tokens
+            self.total_completion_tokens += completion_tokens
+        self.metrics.count("prompt_tokens", prompt_tokens)
+        self.metrics.count("completion_tokens", completion_tokens)
+        return response
+
+    @timed("llm_query")
     def query_template_from_ChatGPT(self, logMessage, messages, temperature, msg):
-        pred_template, prompt_tokens, completion_tokens = gpt_call(messages, model=self.model, temperature=temperature)
-        self.total_prompt_tokens += prompt_tokens
-        self.total_completion_tokens += completion_tokens
+        try:
+            response = self.query_llm(messages, temperature)
+        except LLMCallError as e:
+            # parsing goes on with the heuristic template of the log
+            logger.error("%s, falling back to the heuristic template: %s", e, logMessage, extra={"event": "llm_failure"})
+            self.metrics.count("llm_failures")
+            pred_template, _ = post_process_template(logMessage)
+            return pred_template
+        pred_template = self.extract_template(response, logMessage)
+        logger.info("%s (%s): %s", msg, temperature, pred_template, extra={"event": "answer"})
+        return pred_template
+
+    @timed("llm_batch_query")
+    def query_templates_batch(self, logMessages, messages):
+        """The templates of several log messages from one answer, None for the messages it does not cover."""
+        try:
+            response = self.query_llm(messages, 0.0)
+        except LLMCallError as e:
+            # every message is then queried on its own
+            logger.error("%s, querying the batch one by one", e, extra={"event": "llm_failure"})
+            self.metrics.count("llm_failures")
+            return [None] * len(logMessages)
+        answers = {}
+        for match in batch_answer_pattern.finditer(response):
+            answers.setdefault(int(match.group(1)), match.group(2))
+        pred_templates = []
+        for i, logMessage in enumerate(logMessages, start=1):
+            pred_template = answers.get(i)
+            if pred_template is not None:
+                pred_template = self.extract_template(pred_template, logMessage)
+                logger.info("batch (0.0): %s", pred_template, extra={"event": "answer"})
+            pred_templates.append(pred_template)
+        return pred_templates
+
+    def extract_template(self, pred_template, logMessage):
         pred_template = pred_template.replace("Log template:", "")
         pred_template = pred_template.replace("{non-variable}", "{variables}")
         start_index = pred_template.find('`') + 1
@@ -42,26 +155,31 @@ class LogParser:
         pred_template, flag = post_process_template(pred_template)
         if not flag:
             pred_template, flag = post_process_template(logMessage)
-        print(f"{msg} ({temperature}): {pred_template}")
         return pred_template
 
+    @timed("example_select")
     def example_select(self, examples, logMessage, candidate_num=3):
-        for example in examples:
-            example["sim"] = LCS_similarity(logMessage, example["query"])
-        examples.sort(key=lambda item: item['sim'])
-        return examples[-candidate_num:]
+        if isinstance(examples, CandidateIndex):
+            return examples.top_k(logMessage, candidate_num)
+        return self.similarity.top_k(logMessage, examples, candidate_num)
+
+    @property
+    def template_cache_hits(self):
+        return self.template_cache.hits
+
+    @property
+    def template_cache_misses(self):
+        return self.template_cache.misses
 
     def match_template(self, pred_template, logMessage):
-        rex = pattern1.sub("WILDCARD", pred_template)
-        rex = pattern2.sub(lambda x: re.escape(x.group(0)), rex)
-        rex = rex.replace("WILDCARD", "(\\S.*){0,1}")
-        return re.fullmatch(rex, logMessage)
+        return self.template_cache.get(pred_template, "(\\S.*){0,1}").fullmatch(logMessage)
 
+    @timed("post_process_nomatch")
     def post_process_nomatch(self, pred_template, logMessage, history_messages, temperature):
         if not self.match_template(pred_template, logMessage):
             if set(pred_template.split()) - set(logMessage.split()) == {"{variables}"}:
                 pred_template = pred_template.replace("{variables}", "").strip()
-                print(f"match: {pred_template}")
+                logger.debug("match: %s", pred_template, extra={"event": "match"})
             else:
                 messages = history_messages + ([{"role": "assistant", "content": f"Log template: `{pred_template}`"},
                                                 {"role": "user", "content": post_refine_prompt.format(pred_template, logMessage)}])
@@ -71,24 +189,21 @@ class LogParser:
                 return pred_template, False
         return pred_template, True
 
+    @timed("post_process_constant")
     def post_process_constant(self, pred_template, logMessage, history_messages, temperature):
+        spans = assignment_spans(logMessage)
 
         def get_constants(pred_template):
             if pred_template == logMessage:
                 return ""
-            rex = pattern1.sub("WILDCARD", pred_template)
-            rex = pattern2.sub(lambda x: re.escape(x.group(0)), rex)
-            rex = rex.replace("WILDCARD", "(.*)")
-            match = re.findall(rex, logMessage)
+            match = self.template_cache.get(pred_template, "(.*)").findall(logMessage)
             constants = []
             for tokens in match:
                 tokens = tokens if isinstance(tokens, tuple) else [tokens]
                 for token in tokens:
                     if is_datetime_string(token):
                         continue
-                    if (re.search(r'(?<!Exception)(?<!interrupt)(?<!interrupted)(?<!thrown)(?<!failure)(?<!Error)(?<!read)(?<!Kickstart)(?<!install)(?<!because)'
-                                  r'(?<!address)(?<!died)(?<!failed)(?<!Reason)(?<!Diagnostics)(?<!job)(?<!Responder)(?!<disconnected)(?<!answers)(?<!tftp)(?<!:)'
-                                  r'([=:])\s*' + re.escape(token), logMessage) and
+                    if (follows_assignment(token, spans, logMessage) and
                             all(excluded_str not in token for excluded_str in ["exception", "Exception", "killed", "failed", "Failed", "connected", "Connection"])):
                         continue
                     tmp = []
@@ -121,83 +236,316 @@ class LogParser:
         else:
             return pred_template, True
 
+    def build_messages(self, candidates, logMessage):
+        messages = [
+            {"role": "system", "content": "You are an expert of log parsing, and now you will help to do log parsing."},
+            {"role": "user", "content": parsing_prompt},
+            {"role": "assistant", "content": "Sure, I can help you with log parsing."}
+        ]
+        examples = self.example_select(candidates, logMessage, candidate_num=3)
+        for example in examples:
+            messages.append({"role": "user", "content": f"Log message: `{example['query']}`"})
+            messages.append({"role": "assistant", "content": f"Log template: `{example['answer']}`"})
+        messages.append({"role": "user", "content": f"Log message: `{logMessage}`"})
+        return messages
+
+    def build_batch_messages(self, candidates, logMessages, candidate_num=3):
+        # the examples selected for every message, each shown once
+        examples = {}
+        for logMessage in logMessages:
+            for example in self.example_select(candidates, logMessage, candidate_num=candidate_num):
+                examples.setdefault(example['query'], example['answer'])
+        messages = [
+            {"role": "system", "content": "You are an expert of log parsing, and now you will help to do log parsing."},
+            {"role": "user", "content": batch_parsing_prompt},
+            {"role": "assistant", "content": "Sure, I can help you with log parsing."}
+        ]
+        if examples:
+            messages.append({"role": "user", "content": numbered("Log messages:", examples.keys())})
+            messages.append({"role": "assistant", "content": numbered("Log templates:", examples.values())})
+        messages.append({"role": "user", "content": numbered("Log messages:", logMessages)})
+        return messages
+
+    def query_batch(self, candidates, logMessages):
+        """Query the templates of several messages with one prompt.
+
+        An answer is kept if it passes the same checks as a single answer;
+        the other messages go through the single-message self-correction.
+        """
+        pred_templates = self.query_templates_batch(logMessages, self.build_batch_messages(candidates, logMessages))
+        results = []
+        for logMessage, pred_template in zip(logMessages, pred_templates):
+            messages = self.build_messages(candidates, logMessage)
+            if pred_template is not None:
+                pred_template, flag1 = self.post_process_nomatch(pred_template, logMessage, messages, 0.0)
+                pred_template, flag2 = self.post_process_constant(pred_template, logMessage, messages, 0.0)
+                if flag1 and flag2:
+                    results.append((pred_template, flag1))
+                    continue
+            self.metrics.count("batch_fallbacks")
+            results.append(self.query_template(logMessage, messages))
+        return results
+
+    def query_template(self, logMessage, messages):
+        count = 0
+        flag1, flag2 = False, False
+        pred_template = ""
+        while count < 3 and not (flag1 and flag2):
+            temperature = count * 0.5
+            pred_template = self.query_template_from_ChatGPT(logMessage, messages, temperature, msg="pred")
+            pred_template, flag1 = self.post_process_nomatch(pred_template, logMessage, messages, temperature)
+            pred_template, flag2 = self.post_process_constant(pred_template, logMessage, messages, temperature)
+            count += 1
+        return pred_template, flag1
+
+    def add_template(self, candidates, pred_template, flag, logMessage, stop_node, logIDs):
+        if not flag:
+            logger.info("not match!!! %s", pred_template, extra={"event": "not_match"})
+        else:
+            candidates.append({"query": logMessage, "answer": pred_template})
+        self.trie.update(pred_template, stop_node, logIDs)
+
+    def load_candidates(self, dataset_name):
+        if self.snapshot:
+            return CandidateIndex(self.load_snapshot(self.snapshot), self.similarity)
+        candidates = read_json_file(os.path.join(self.examples_dir, f"sampled_examples_{self.log_ratio}%", dataset_name, "32shot.json"))
+        for d in candidates:
+            self.trie.insert(d["answer"])
+        return CandidateIndex(candidates, self.similarity)
+
+    def save_snapshot(self, path, candidates):
+        snapshot = {
+            "templates": self.trie.dump(),
+            "candidates": [{"query": d["query"], "answer": d["answer"]} for d in candidates]
+        }
+        with gzip.open(path, 'wt', encoding='utf-8') as fw:
+            json.dump(snapshot, fw, ensure_ascii=False)
+
+    def load_snapshot(self, path):
+        """Warm-start the trie from a snapshot and return its candidates; logIDs of the previous run are not restored."""
+        with gzip.open(path, 'rt', encoding='utf-8') as fr:
+            snapshot = json.load(fr)
+        self.trie.load(snapshot["templates"])
+        return snapshot["candidates"]
+
     def parse(self, logName):
         file_path = os.path.join(self.indir, logName)
-        print("Parsing file: " + file_path)
+        logger.info("Parsing file: %s", file_path)
 
         dataset_name = logName.split('_')[0]
-        candidates = read_json_file(f"../../full_dataset/sampled_examples_{self.log_ratio}%/{dataset_name}/32shot.json")
-        for d in candidates:
-            self.trie.insert(d["answer"])
+        candidates = self.load_candidates(dataset_name)
+
+        self.query_num = 0
+        scheduler = self.make_scheduler(candidates)
+        if self.chunk_size:
+            total_lines = 0
+            for chunk in self.load_chunks(file_path):
+                self.parse_lines(chunk["Content"], candidates, scheduler, start=total_lines + 1)
+                total_lines += len(chunk)
+        elif self.shards > 1:
+            self.load_data(file_path)
+            self.parse_shards(dataset_name, self.df_log["Content"], candidates)
+        else:
+            self.load_data(file_path)
+            self.parse_lines(self.df_log["Content"], candidates, scheduler)
+        if scheduler is not None:
+            scheduler.flush()
 
-        self.load_data(file_path)
-        query_num = 0
-        total_lines = len(self.df_log)
+        if not os.path.exists(self.outdir):
+            os.makedirs(self.outdir)
+        if self.chunk_size:
+            self.outputStream(logName, file_path, total_lines)
+        else:
+            self.outputResult(logName)
+        self.save_snapshot(os.path.join(self.outdir, logName + '_snapshot.json.gz'), candidates)
+        logger.info(f"dataset: {logName}, total_prompt_tokens: {self.total_prompt_tokens}, total_completion_tokens: {self.total_completion_tokens}, "
+                    f"template_cache_hits: {self.template_cache_hits}, template_cache_misses: {self.template_cache_misses}, "
+                    f"tokenizer_cache_hits: {self.trie.tokenizer.hits}, tokenizer_cache_misses: {self.trie.tokenizer.misses}")
+        if self.cache is not None:
+            logger.info(f"response_cache_hits: {self.cache.hits}, response_cache_misses: {self.cache.misses}")
+        logger.info("stage metrics:\n%s", self.metrics.summary())
+        if self.metrics_format:
+            self.metrics.export(os.path.join(self.outdir, logName + ('_metrics.prom' if self.metrics_format == 'prometheus' else '_metrics.json')))
+
+    def make_scheduler(self, candidates):
+        # batches and pre-clusters are formed from buffered misses, so they need a window even if none was asked for
+        window = self.query_window or (64 if self.precluster else self.batch_size if self.batch_size > 1 else 0)
+        if not window:
+            return None
+        return QueryScheduler(self, candidates, window, self.concurrency, self.batch_size,
+                              PreClusterer() if self.precluster else None)
 
-        for logID, logMessage in enumerate(self.df_log["Content"], start=1):
-            logMessage = logMessage.strip()
-            stop_node, flag = self.trie.search(logMessage)
+    def parse_lines(self, contents, candidates, scheduler=None, start=1):
+        self.parse_groups(group_lines(contents, start).items(), candidates, scheduler, start + len(contents) - 1)
+
+    def parse_groups(self, log_groups, candidates, scheduler=None, total_lines=None):
+        log_groups = list(log_groups)
+        message_tokens = self.trie.tokenizer.split_messages(logMessage for logMessage, _ in log_groups)
+        for (logMessage, logIDs), tokens in zip(log_groups, message_tokens):
+            stop_node, flag = self.trie.search(logMessage, tokens)
+            self.metrics.count("lines", len(logIDs))
+            self.metrics.count("search_hits" if flag else "search_misses")
             if flag:
-                stop_node.logIDs.append(logID)
+                stop_node.logIDs.extend(logIDs)
+            elif scheduler is not None:
+                scheduler.submit(logMessage, logIDs)
             else:
-                query_num += 1
-                print(f"{logID}/{total_lines}: {logMessage} (query times: {query_num})")
-                messages = [
-                    {"role": "system", "content": "You are an expert of log parsing, and now you will help to do log parsing."},
-                    {"role": "user", "content": parsing_prompt},
-                    {"role": "assistant", "content": "Sure, I can help you with log parsing."}
-                ]
-                examples = self.example_select(candidates, logMessage, candidate_num=3)
-                for example in examples:
-                    messages.append({"role": "user", "content": f"Log message: `{example['query']}`"})
-                    messages.append({"role": "assistant", "content": f"Log template: `{example['answer']}`"})
-                messages.append({"role": "user", "content": f"Log message: `{logMessage}`"})
-
-                count = 0
-                flag1, flag2 = False, False
-                pred_template = ""
-                while count < 3 and not (flag1 and flag2):
-                    temperature = count * 0.5
-                    pred_template = self.query_template_from_ChatGPT(logMessage, messages, temperature, msg="pred")
-                    pred_template, flag1 = self.post_process_nomatch(pred_template, logMessage, messages, temperature)
-                    pred_template, flag2 = self.post_process_constant(pred_template, logMessage, messages, temperature)
-                    count += 1
-                if not flag1:
-                    print(f"not match!!! {pred_template}")
-                else:
-                    candidates.append({"query": logMessage, "answer": pred_template})
-
-                self.trie.update(pred_template, stop_node, logID)
+                self.query_num += 1
+                logger.info("%s/%s: %s (query times: %d)", logIDs[0], total_lines, logMessage, self.query_num, extra={"event": "query"})
+                messages = self.build_messages(candidates, logMessage)
+                pred_template, flag1 = self.query_template(logMessage, messages)
+                self.add_template(candidates, pred_template, flag1, logMessage, stop_node, logIDs)
 
-        if not os.path.exists(self.outdir):
-            os.makedirs(self.outdir)
-        self.outputResult(logName)
-        print(f"dataset: {logName}, total_prompt_tokens: {self.total_prompt_tokens}, total_completion_tokens: {self.total_completion_tokens}")
+    def parse_shards(self, dataset_name, contents, candidates):
+        """Parse the shards of a log in worker processes and merge their templates into this parser's trie."""
+        from concurrent.futures import ProcessPoolExecutor
+
+        shards = [[] for _ in range(self.shards)]
+        for logMessage, logIDs in group_lines(contents).items():
+            shards[shard_of(logMessage, self.shards)].append((logMessage, logIDs))
 
+        with ProcessPoolExecutor(max_workers=self.shards) as executor:
+            futures = [executor.submit(parse_shard, self.shard_params(), dataset_name, shard, len(contents)) for shard in shards]
+            for future in futures:
+                templates, new_candidates, prompt_tokens, completion_tokens, query_num, metrics = future.result()
+                for template, logIDs in templates:
+                    self.trie.insert(template, logIDs)
+                for candidate in new_candidates:
+                    candidates.append(candidate)
+                self.total_prompt_tokens += prompt_tokens
+                self.total_completion_tokens += completion_tokens
+                self.query_num += query_num
+                self.metrics.merge(metrics)
+
+    def shard_params(self):
+        return {
+            'indir': self.indir, 'outdir': self.outdir, 'model': self.model, 'log_ratio': self.log_ratio,
+            'template_cache_size': self.template_cache.maxsize, 'query_window': self.query_window,
+            'concurrency': self.concurrency, 'cache_path': self.cache.path if self.cache is not None else None,
+            'snapshot': self.snapshot, 'compact_trie': isinstance(self.trie, CompactTrie),
+            'examples_dir': self.examples_dir, 'merge_index': self.trie.merge_index is not None,
+            'batch_size': self.batch_size,
+            'precluster': self.precluster,
+            # every shard runs in its own process with its own limiter, so each gets a share of the limits
+            'requests_per_minute': self.requests_per_minute / self.shards if self.requests_per_minute else None,
+            'tokens_per_minute': self.tokens_per_minute / self.shards if self.tokens_per_minute else None
+        }
+
+    @timed("output")
     def outputResult(self, logName):
-        log_templateids = [""] * self.df_log.shape[0]
-        log_templates = [""] * self.df_log.shape[0]
-        df_events = []
+        codes, event_ids, event_templates, df_events = self.assign_templates(self.df_log.shape[0])
+        self.df_log['EventId'] = categorical(event_ids, codes)
+        self.df_log['EventTemplate'] = categorical(event_templates, codes)
+        self.df_log.to_csv(os.path.join(self.outdir, logName + '_structured.csv'), index=False)
+        for output_format in self.output_formats:
+            # Parquet and Feather need pyarrow (or fastparquet for Parquet)
+            path = os.path.join(self.outdir, f"{logName}_structured.{output_format}")
+            if output_format == 'parquet':
+                self.df_log.to_parquet(path, index=False)
+            elif output_format == 'feather':
+                self.df_log.reset_index(drop=True).to_feather(path)
+            else:
+                raise ValueError(f"Unknown output format: {output_format}")
+        df_events.to_csv(os.path.join(self.outdir, logName + '_templates.csv'), index=False)
+
+    def assign_templates(self, total_lines):
+        """Return the template code of every log line with the EventId and EventTemplate of each code.
+
+        Code -1 (lines without a template) points at the trailing empty entry.
+        """
+        import numpy as np
+        import pandas as pd
+
+        codes = np.full(total_lines, -1, dtype=np.int32)
+        event_ids, event_templates, df_events = [], [], []
 
         def dfs(node):
             if node.is_end_of_token:
                 template_id = hashlib.md5(node.tokens.encode('utf-8')).hexdigest()[0:8]
-                for logID in node.logIDs:
-                    logID -= 1
-                    log_templateids[logID] = template_id
-                    log_templates[logID] = re.sub(r"\{\w+}", "<*>", node.tokens)
+                codes[np.asarray(node.logIDs, dtype=np.int64) - 1] = len(event_ids)
+                event_ids.append(template_id)
+                event_templates.append(pattern1.sub("<*>", node.tokens))
                 df_events.append([template_id, node.tokens, len(node.logIDs)])
-            for child in node.children.values():
+            for child in node.sorted_children():
                 dfs(child)
 
         dfs(self.trie.root)
+        event_ids.append("")
+        event_templates.append("")
         df_events = pd.DataFrame(df_events, columns=['EventId', 'EventTemplate', 'Occurrences'])
-        self.df_log['EventId'] = log_templateids
-        self.df_log['EventTemplate'] = log_templates
-        self.df_log.to_csv(os.path.join(self.outdir, logName + '_structured.csv'), index=False)
+        return codes, np.array(event_ids, dtype=object), np.array(event_templates, dtype=object), df_events
+
+    @timed("output")
+    def outputStream(self, logName, file_path, total_lines):
+        codes, event_ids, event_templates, df_events = self.assign_templates(total_lines)
+        structured_path = os.path.join(self.outdir, logName + '_structured.csv')
+        start = 0
+        for i, chunk in enumerate(self.load_chunks(file_path)):
+            chunk_codes = codes[start:start + len(chunk)]
+            chunk['EventId'] = event_ids[chunk_codes]
+            chunk['EventTemplate'] = event_templates[chunk_codes]
+            chunk.to_csv(structured_path, mode='w' if i == 0 else 'a', header=i == 0, index=False)
+            start += len(chunk)
         df_events.to_csv(os.path.join(self.outdir, logName + '_templates.csv'), index=False)
 
     def load_data(self, file_path):
+        import pandas as pd
         csv_path = os.path.join(file_path + '_structured.csv')
         if os.path.exists(csv_path):
             self.df_log = pd.read_csv(csv_path)
+
+    def load_chunks(self, file_path):
+        """Yield the log in DataFrames of chunk_size rows, from the structured CSV if present, else from raw lines."""
+        import pandas as pd
+
+        csv_path = os.path.join(file_path + '_structured.csv')
+        if os.path.exists(csv_path):
+            yield from pd.read_csv(csv_path, chunksize=self.chunk_size, dtype=str, keep_default_na=False)
+            return
+        with open(file_path, 'r', encoding='utf-8', errors='replace') as fr:
+            lineId = 0
+            while True:
+                lines = [line.rstrip('\r\n') for line in itertools.islice(fr, self.chunk_size)]
+                if not lines:
+                    break
+                yield pd.DataFrame({'LineId': range(lineId + 1, lineId + len(lines) + 1), 'Content': lines})
+                lineId += len(lines)
+
+
+def categorical(values, codes):
+    """The column values[codes] as a Categorical, each distinct value stored once."""
+    import pandas as pd
+    value_codes, uniques = pd.factorize(values)
+    return pd.Categorical.from_codes(value_codes[codes], uniques)
+
+
+def numbered(title, lines):
+    return "\n".join([title] + [f"{i}. `{line}`" for i, line in enumerate(lines, start=1)])
+
+
+def group_lines(contents, start=1):
+    # identical messages always follow the same path, so each distinct one is parsed once
+    log_groups = defaultdict(list)
+    for logID, logMessage in enumerate(contents, start=start):
+        log_groups[logMessage.strip()].append(logID)
+    return log_groups
+
+
+def shard_of(logMessage, shards):
+    """Stable shard of a message, from its first token without digits, so lines of a template tend to share a shard."""
+    key = next((token for token in message_split(logMessage) if not any(c.isdigit() for c in token)), "")
+    return zlib.crc32(key.encode('utf-8')) % shards
+
+
+def parse_shard(params, dataset_name, log_groups, total_lines):
+    parser = LogParser(**params)
+    candidates = parser.load_candidates(dataset_name)
+    known_candidates = len(candidates)
+    scheduler = parser.make_scheduler(candidates)
+    parser.parse_groups(log_groups, candidates, scheduler, total_lines)
+    if scheduler is not None:
+        scheduler.flush()
+    templates = [(node.tokens, list(node.logIDs)) for node in parser.trie.nodes() if node.logIDs]
+    new_candidates = [{"query": d["query"], "answer": d["answer"]} for d in candidates[known_candidates:]]
+    return (templates, new_candidates, parser.total_prompt_tokens, parser.total_completion_tokens, parser.query_num,
+            parser.metrics.report())
@@ -1,9 +1,25 @@
+import logging
 import re
+from array import array
 from collections import defaultdict
+from types import MappingProxyType
 
 from sortedcontainers import SortedDict
 
-from .utils import LCS_similarity, custom_key, message_split, post_process_template, is_camel_case
+from .metrics import timed
+from .similarity import SimilarityEngine
+from .tokenizer import Tokenizer
+from .utils import custom_key, post_process_template, is_camel_case
+
+logger = logging.getLogger(__name__)
+
+# merge_templates aligns templates on these delimiters
+merge_delimiters = re.compile(r"([ ,():\[\]])")
+
+
+def merge_key(template):
+    """Templates that merge_templates can align: the same number of words and the same delimiter skeleton."""
+    return len(template.split()), tuple(merge_delimiters.split(template)[1::2])
 
 
 class TrieNode:
@@ -14,17 +30,94 @@ class TrieNode:
         self.logIDs = []
         self.tokens = ""
 
+    @property
+    def wildcard(self):
+        return self.children.get("<*>")
+
+    def add_child(self, token):
+        child = self.children.get(token)
+        if child is None:
+            child = self.children[token] = TrieNode(token)
+        return child
+
+    def remove_child(self, token):
+        del self.children[token]
+
+    def has_children(self):
+        return bool(self.children)
+
+    def sorted_children(self):
+        return self.children.values()
+
+
+# shared by all compact nodes without literal children, read-only so it is never filled by mistake
+NO_CHILDREN = MappingProxyType({})
+
+
+class CompactTrieNode:
+    """A TrieNode that takes several times less memory on large logs.
+
+    Literal children are kept in a plain dict, allocated only for the first
+    child, and the <*> child in its own slot; they are sorted only when the
+    trie is walked in order. LogIDs are stored as 4-byte integers.
+    """
+    __slots__ = ("children", "wildcard", "token", "is_end_of_token", "logIDs", "tokens")
+
+    def __init__(self, token=None):
+        self.children = NO_CHILDREN
+        self.wildcard = None
+        self.token = token
+        self.is_end_of_token = False
+        self.logIDs = array('I')
+        self.tokens = ""
+
+    def add_child(self, token):
+        if token == "<*>":
+            if self.wildcard is None:
+                self.wildcard = CompactTrieNode(token)
+            return self.wildcard
+        child = self.children.get(token)
+        if child is None:
+            if self.children is NO_CHILDREN:
+                self.children = {}
+            child = self.children[token] = CompactTrieNode(token)
+        return child
+
+    def remove_child(self, token):
+        if token == "<*>":
+            self.wildcard = None
+        else:
+            del self.children[token]
+            if not self.children:
+                self.children = NO_CHILDREN
+
+    def has_children(self):
+        return bool(self.children) or self.wildcard is not None
+
+    def sorted_children(self):
+        children = list(self.children.items())
+        if self.wildcard is not None:
+            children.append(("<*>", self.wildcard))
+        return [child for _, child in sorted(children, key=lambda item: custom_key(item[0]))]
+
 
 class Trie:
-    def __init__(self):
-        self.root = TrieNode("RootTrieNode")
+    node_class = TrieNode
+
+    def __init__(self, metrics=None, merge_index=False):
+        self.root = self.node_class("RootTrieNode")
+        self.metrics = metrics
+        self.similarity = SimilarityEngine()
+        self.tokenizer = Tokenizer()
+        # merge_key -> templates, so that update only compares templates merge_templates can align
+        self.merge_index = defaultdict(set) if merge_index else None
 
     def merge_templates(self, similarity, group_templates, event_template):
         template_length = len(event_template.split())
         if not all(len(template.split()) == template_length for template in group_templates):
             return ""
 
-        template_lists = [re.split(r"([ ,():\[\]])", template) for template in group_templates + [event_template]]
+        template_lists = [merge_delimiters.split(template) for template in group_templates + [event_template]]
         merged_template_tokens, merged_tokens = [], set()
 
         for tokens in zip(*template_lists):
@@ -50,18 +143,20 @@ class Trie:
 
         return merged_template
 
+    @timed("trie_update")
     def update(self, event_template, stop_node, logID):
-        logIDs = [logID]
+        logIDs = list(logID) if isinstance(logID, list) else [logID]
         clusters = defaultdict(list)
-        if (event_template.count("{variables}") + 1) / len(message_split(event_template)) <= 0.5:
+        if (event_template.count("{variables}") + 1) / len(self.tokenizer.split(event_template)) <= 0.5:
             relevant_templates = self.get_related_templates(stop_node, event_template)
             for template in relevant_templates:
                 clusters[template["sim"]].append(template["template"])
             for similarity, group_templates in clusters.items():
                 merged_template = self.merge_templates(similarity, group_templates, event_template)
                 if merged_template:
-                    print(similarity, group_templates)
-                    print(f"=> {merged_template}")
+                    logger.info("%s %s => %s", similarity, group_templates, merged_template, extra={"event": "merge"})
+                    if self.metrics is not None:
+                        self.metrics.count("merges")
                     logIDs += [log_id for template in group_templates for log_id in self.delete(template)]
                     event_template = merged_template
 
@@ -69,10 +164,12 @@ class Trie:
 
     def insert(self, event_template, logID=None):
         node = self.root
-        for token in message_split(event_template):
-            if token not in node.children:
-                node.children[token] = TrieNode(token)
-            node = node.children[token]
+        for token in self.tokenizer.split(event_template):
+            node = node.add_child(token)
+        if self.merge_index is not None:
+            if node.is_end_of_token:
+                self.merge_index[merge_key(node.tokens)].discard(node.tokens)
+            self.merge_index[merge_key(event_template)].add(event_template)
         node.is_end_of_token = True
         node.tokens = event_template
         if logID:
@@ -80,71 +177,121 @@ class Trie:
 
     def delete(self, event_template):
         node, parents = self.root, []
-        tokens = message_split(event_template)
-        for token in tokens:
+        for token in self.tokenizer.split(event_template):
             parents.append((token, node))
-            node = node.children[token]
+            node = node.wildcard if token == "<*>" else node.children[token]
 
         node.is_end_of_token = False
+        if self.merge_index is not None:
+            self.merge_index[merge_key(node.tokens)].discard(node.tokens)
         logIDs = node.logIDs
         for token, parent in reversed(parents):
-            if node.children or node.is_end_of_token:
+            if node.has_children() or node.is_end_of_token:
                 break
-            del parent.children[token]
+            parent.remove_child(token)
             node = parent
 
         return logIDs
 
-    def search(self, logMessage):
-        message_tokens = message_split(logMessage)
+    @timed("search")
+    def search(self, logMessage, message_tokens=None):
+        if message_tokens is None:
+            message_tokens = self.tokenizer.tokenize(logMessage)
         message_length = len(message_tokens)
 
-        def dfs(node, index):
-            if index == message_length:
-                if node.is_end_of_token:
-                    return node, node.is_end_of_token
-                elif "<*>" in node.children:
-                    return node.children["<*>"], node.children["<*>"].is_end_of_token
-                else:
-                    return node, node.is_end_of_token
+        def match_end(node):
+            if node.is_end_of_token:
+                return node, True
+            wildcard = node.wildcard
+            if wildcard is not None:
+                return wildcard, wildcard.is_end_of_token
+            return node, False
 
+        def expand(node, index):
+            # yields the (child, index) states in the order the matcher tries them:
+            # the literal child first, then every skip length under the <*> child
             token = message_tokens[index]
-            if token in node.children:
-                matched_node, is_complete = dfs(node.children[token], index + 1)
-                if is_complete:
-                    return matched_node, is_complete
-
-            if "<*>" in node.children:
+            wildcard = node.wildcard
+            child = wildcard if token == "<*>" else node.children.get(token)
+            if child is not None:
+                yield child, index + 1
+            if wildcard is not None:
                 flag = True
                 for skip in range(index, message_length + 1):
                     if (skip + 2 < message_length
                             and node.token == "="
                             and message_tokens[skip].isalpha()
                             and message_tokens[skip + 1] == node.token
-                            and message_tokens[skip] not in node.children["<*>"].children):
+                            and message_tokens[skip] not in wildcard.children):
                         if not message_tokens[skip + 2].isdigit():
                             flag = False
                         elif flag and message_tokens[skip + 2].isdigit():
                             break
-                    matched_node, is_complete = dfs(node.children["<*>"], skip)
+                    yield wildcard, skip
+
+        if message_length == 0:
+            return match_end(self.root)
+
+        # a (node, index) state that failed once fails again, so each state is expanded at most once
+        failed = set()
+        stack = [expand(self.root, 0)]
+        while stack:
+            for child, index in stack[-1]:
+                if (child, index) in failed:
+                    continue
+                if index == message_length:
+                    matched_node, is_complete = match_end(child)
                     if is_complete:
                         return matched_node, is_complete
-            return node, False
+                    failed.add((child, index))
+                    continue
+                failed.add((child, index))
+                stack.append(expand(child, index))
+                break
+            else:
+                stack.pop()
+        return self.root, False
+
+    def nodes(self, node=None):
+        """Yield the template nodes under node (the root by default) in depth-first order."""
+        stack = [node or self.root]
+        while stack:
+            node = stack.pop()
+            if node.is_end_of_token:
+                yield node
+            stack.extend(reversed(node.sorted_children()))
 
-        return dfs(self.root, 0)
+    def dump(self):
+        """Return [template, number of logIDs] for every template, enough to rebuild the node structure with insert."""
+        return [[node.tokens, len(node.logIDs)] for node in self.nodes()]
+
+    def load(self, templates):
+        for template, _ in templates:
+            self.insert(template)
 
     def get_related_templates(self, node, pred_templates):
-        relevant_templates = []
-        similarity = LCS_similarity(pred_templates, node.tokens)
-        if node.is_end_of_token:
-            relevant_templates.append({
-                "template": node.tokens,
-                "sim": similarity
-            })
-        for child in node.children.values():
-            templates = self.get_related_templates(child, pred_templates)
-            relevant_templates.extend(templates)
-        return relevant_templates
+        if self.merge_index is not None:
+            templates = self.indexed_templates(node, pred_templates)
+        else:
+            templates = [node.tokens for node in self.nodes(node)]
+        similarities = self.similarity.similarities(pred_templates, templates)
+        return [{"template": template, "sim": similarity} for template, similarity in zip(templates, similarities)]
+
+    def indexed_templates(self, node, pred_templates):
+        """The templates under node with the merge_key of pred_templates, in the depth-first order of nodes()."""
+        templates = []
+        for template in self.merge_index.get(merge_key(pred_templates), ()):
+            tokens = self.tokenizer.split(template)
+            if node is not self.root:
+                current = self.root
+                for token in tokens:
+                    current = current.wildcard if token == "<*>" else current.children.get(token)
+                    if current is node:
+                        break
+                else:
+                    continue
+            templates.append((tuple(custom_key(token) for token in tokens), template))
+        return [template for _, template in sorted(templates)]
 
     def print_trie(self, node=None, path=None):
         if node is None:
@@ -157,5 +304,10 @@ class Trie:
         if node.is_end_of_token:
             print(' -> '.join(path), node.logIDs)
 
-        for child in node.children.values():
+        for child in node.sorted_children():
             self.print_trie(child, list(path))
+
+
+class CompactTrie(Trie):
+    """A Trie of CompactTrieNodes, for logs with tens of millions of lines."""
+    node_class = CompactTrieNode
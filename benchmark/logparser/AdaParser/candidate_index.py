@@ -0,0 +1,72 @@
+import heapq
+from array import array
+from collections import Counter
+
+from .utils import lcs_length
+
+
+class CandidateIndex:
+    """The in-context candidates, with an inverted index from query tokens to the candidates containing them.
+
+    For a new message, the shared-token counts give an upper bound of the LCS
+    similarity of every candidate in a few NumPy operations. Candidates are
+    then scored exactly in decreasing order of that bound, stopping as soon as
+    no remaining candidate can enter the top k, so the result is the same as
+    scoring every candidate.
+    """
+
+    def __init__(self, candidates, similarity):
+        self.candidates = []
+        self.similarity = similarity
+        self.postings = {}
+        self.lengths = array('i')
+        for candidate in candidates:
+            self.append(candidate)
+
+    def __len__(self):
+        return len(self.candidates)
+
+    def __iter__(self):
+        return iter(self.candidates)
+
+    def __getitem__(self, index):
+        return self.candidates[index]
+
+    def append(self, candidate):
+        sequence = self.similarity.encode(candidate["query"])
+        index = len(self.candidates)
+        self.candidates.append(candidate)
+        self.lengths.append(len(sequence))
+        for token_id, count in Counter(sequence).items():
+            posting = self.postings.get(token_id)
+            if posting is None:
+                posting = self.postings[token_id] = (array('i'), array('i'))
+            posting[0].append(index)
+            posting[1].append(count)
+
+    def top_k(self, query, k):
+        """Return the k candidates most similar to the query, least similar first; ties go to later candidates."""
+        if not self.candidates or k <= 0:
+            return []
+        import numpy as np
+        masks, length = self.similarity.query_masks(query)
+        overlap = np.zeros(len(self.candidates), dtype=np.int64)
+        for token_id, mask in masks.items():
+            posting = self.postings.get(token_id)
+            if posting is not None:
+                indices = np.array(posting[0], dtype=np.int32)
+                overlap[indices] += np.minimum(np.array(posting[1], dtype=np.int32), bin(mask).count("1"))
+        bounds = 2 * overlap / (length + np.array(self.lengths, dtype=np.int32))
+        order = np.lexsort((np.arange(len(self.candidates)), bounds))[::-1]
+
+        top = []
+        for i in order.tolist():
+            if len(top) == k and (bounds[i], i) < top[0]:
+                break
+            sequence = self.similarity.encode(self.candidates[i]["query"])
+            item = (2 * lcs_length(masks, length, sequence) / (length + len(sequence)), i)
+            if len(top) < k:
+                heapq.heappush(top, item)
+            else:
+                heapq.heappushpop(top, item)
+        return [self.candidates[i] for _, i in sorted(top)]
@@ -0,0 +1,39 @@
+import functools
+
+import regex as re
+
+# a "=" or ":" that does not follow one of these words, with the whitespace after it
+assignment_regex = re.compile(r'(?<!Exception)(?<!interrupt)(?<!interrupted)(?<!thrown)(?<!failure)(?<!Error)(?<!read)(?<!Kickstart)(?<!install)(?<!because)'
+                              r'(?<!address)(?<!died)(?<!failed)(?<!Reason)(?<!Diagnostics)(?<!job)(?<!Responder)(?!<disconnected)(?<!answers)(?<!tftp)(?<!:)'
+                              r'[=:](\s*)')
+digit_regex = re.compile(r'\d')
+name_regex = None
+
+
+def assignment_spans(logMessage):
+    """The whitespace spans after every "key=" or "key:" separator of a log message, found in one scan."""
+    return [match.span(1) for match in assignment_regex.finditer(logMessage)]
+
+
+def follows_assignment(token, spans, logMessage):
+    """Whether the token appears right after a separator, with any part of the whitespace after it in between."""
+    return any(logMessage.startswith(token, position) for start, end in spans for position in range(start, end + 1))
+
+
+@functools.lru_cache(maxsize=65536)
+def is_datetime_string(s):
+    from dateutil import parser
+    global name_regex
+    if not digit_regex.search(s):
+        # without a digit, dateutil finds a date only in month and weekday names
+        if name_regex is None:
+            info = parser.parserinfo()
+            names = sorted({name for names in info.MONTHS + info.WEEKDAYS for name in names}, key=len)
+            name_regex = re.compile("|".join(names), re.IGNORECASE)
+        if not name_regex.search(s):
+            return False
+    try:
+        parser.parse(s)
+        return True
+    except (ValueError, OverflowError):
+        return False
@@ -0,0 +1,101 @@
+import email.utils
+import random
+import threading
+import time
+
+
+class LLMCallError(Exception):
+    """An LLM call that failed for good: a non-retryable error, or retries exhausted."""
+
+    def __init__(self, message, attempts=0, status_code=None):
+        super().__init__(message)
+        self.attempts = attempts
+        self.status_code = status_code
+
+
+class TokenBucket:
+    """Allows `per_minute` units per minute, in bursts of up to a minute's worth. Safe to share between threads."""
+
+    def __init__(self, per_minute):
+        self.capacity = float(per_minute)
+        self.rate = per_minute / 60.0
+        self.tokens = self.capacity
+        self.last = time.monotonic()
+        self.lock = threading.Lock()
+
+    def refill(self, now):
+        self.tokens = min(self.capacity, self.tokens + (now - self.last) * self.rate)
+        self.last = now
+
+    def acquire(self, amount=1):
+        """Wait until amount units are available and take them; amounts above the capacity wait for a full bucket."""
+        amount = min(amount, self.capacity)
+        while True:
+            with self.lock:
+                self.refill(time.monotonic())
+                if self.tokens >= amount:
+                    self.tokens -= amount
+                    return
+                wait = (amount - self.tokens) / self.rate
+            time.sleep(wait)
+
+    def adjust(self, amount):
+        """Take amount more units (or give them back if negative) without waiting, e.g. once the real usage is known."""
+        with self.lock:
+            self.refill(time.monotonic())
+            self.tokens = min(self.capacity, self.tokens - amount)
+
+
+class RateLimiter:
+    """Request and token rate limits of an LLM endpoint, shared by all the threads that call it.
+
+    The tokens of a call are reserved from an estimate of the prompt before it
+    is sent and corrected with the reported usage after it returns.
+    """
+
+    def __init__(self, requests_per_minute=None, tokens_per_minute=None):
+        self.requests = TokenBucket(requests_per_minute) if requests_per_minute else None
+        self.tokens = TokenBucket(tokens_per_minute) if tokens_per_minute else None
+
+    @staticmethod
+    def estimate(messages):
+        # about 4 characters per token
+        return sum(len(m["content"]) for m in messages) // 4
+
+    def acquire(self, messages):
+        estimated = self.estimate(messages)
+        if self.requests is not None:
+            self.requests.acquire()
+        if self.tokens is not None:
+            self.tokens.acquire(estimated)
+        return estimated
+
+    def settle(self, estimated, used):
+        if self.tokens is not None:
+            self.tokens.adjust(used - estimated)
+
+
+def retry_after(error):
+    """Seconds the server asked to wait in the Retry-After (or retry-after-ms) header of an error's response, if any."""
+    response = getattr(error, "response", None)
+    if response is None:
+        return None
+    headers = response.headers
+    try:
+        if headers.get("retry-after-ms"):
+            return float(headers["retry-after-ms"]) / 1000
+        value = headers.get("retry-after")
+        if not value:
+            return None
+        try:
+            return float(value)
+        except ValueError:
+            return max(0.0, email.utils.parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+def backoff_delay(attempt, base=1.0, cap=60.0, wait=None):
+    """Exponential backoff with full jitter, at least as long as the wait the server asked for."""
+    delay = random.uniform(0, min(cap, base * 2 ** attempt))
+    return max(delay, wait) if wait is not None else delay
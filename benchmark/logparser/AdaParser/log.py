@@ -0,0 +1,117 @@
+import atexit
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import sys
+import threading
+import time
+
+logger = logging.getLogger(__package__)
+listener = None
+settings = None
+
+
+class RateLimitFilter(logging.Filter):
+    """Lets through at most `rate` records per second (bursts of `burst`) of each per-line event.
+
+    Per-line events are the records logged with an `event` extra; the number
+    of records dropped since the last one that passed is attached to it as
+    `suppressed`. Warnings and errors always pass.
+    """
+
+    def __init__(self, rate, burst=None):
+        super().__init__()
+        self.rate = rate
+        self.burst = burst or max(rate, 1)
+        self.buckets = {}
+        self.suppressed = {}
+        self.lock = threading.Lock()
+
+    def filter(self, record):
+        event = getattr(record, "event", None)
+        if event is None or record.levelno >= logging.WARNING:
+            return True
+        now = time.monotonic()
+        with self.lock:
+            tokens, last = self.buckets.get(event, (self.burst, now))
+            tokens = min(self.burst, tokens + (now - last) * self.rate)
+            if tokens < 1:
+                self.buckets[event] = (tokens, now)
+                self.suppressed[event] = self.suppressed.get(event, 0) + 1
+                return False
+            self.buckets[event] = (tokens - 1, now)
+            record.suppressed = self.suppressed.pop(event, 0)
+        return True
+
+
+class StructuredFormatter(logging.Formatter):
+    """One line per record, as text or as a JSON object carrying the event name and the suppressed count."""
+
+    def __init__(self, structured=False):
+        super().__init__('%(asctime)s - %(levelname)s - %(message)s')
+        self.structured = structured
+
+    def format(self, record):
+        suppressed = getattr(record, "suppressed", 0)
+        if not self.structured:
+            line = super().format(record)
+            return f"{line} ({suppressed} similar suppressed)" if suppressed else line
+        entry = {
+            "time": self.formatTime(record),
+            "level": record.levelname,
+            "logger": record.name,
+            "event": getattr(record, "event", None),
+            "message": record.getMessage()
+        }
+        if suppressed:
+            entry["suppressed"] = suppressed
+        if record.exc_info:
+            entry["exception"] = self.formatException(record.exc_info)
+        return json.dumps(entry, ensure_ascii=False)
+
+
+def configure_logging(level="INFO", structured=False, rate=None, stream=None):
+    """Send the parser's logs through a queue to a background thread that writes them to stream (stderr by default).
+
+    The parsing loop only formats and enqueues a record, it never waits for
+    the output. With rate, each per-line event is limited to that many
+    records per second.
+    """
+    global listener, settings
+    stop_logging()
+    settings = (level, structured, rate, stream)
+    handler = logging.StreamHandler(stream if stream is not None else sys.stderr)
+    handler.setFormatter(StructuredFormatter(structured))
+    records = queue.SimpleQueue()
+    queue_handler = logging.handlers.QueueHandler(records)
+    if rate:
+        queue_handler.addFilter(RateLimitFilter(rate))
+    for existing in list(logger.handlers):
+        logger.removeHandler(existing)
+    logger.addHandler(queue_handler)
+    logger.setLevel(level)
+    logger.propagate = False
+    listener = logging.handlers.QueueListener(records, handler)
+    listener.start()
+
+
+def stop_logging():
+    """Write out the queued records and stop the background thread."""
+    global listener
+    if listener is not None:
+        listener.stop()
+        listener = None
+
+
+def restart_in_child():
+    # a forked worker inherits the queue handler but not the thread that empties the queue
+    global listener
+    if settings is not None:
+        listener = None
+        configure_logging(*settings)
+
+
+atexit.register(stop_logging)
+os.register_at_fork(after_in_child=restart_in_child)
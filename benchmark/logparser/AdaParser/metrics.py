@@ -0,0 +1,103 @@
+import functools
+import json
+import threading
+import time
+from contextlib import contextmanager
+
+
+class Metrics:
+    """Timers and counters of the parsing stages.
+
+    A timer records the number of calls and the total and maximum wall time
+    of a stage; times are inclusive, e.g. post_process_nomatch includes the
+    LLM calls it makes. Safe to share between threads.
+    """
+
+    def __init__(self):
+        self.timers = {}
+        self.counters = {}
+        self.lock = threading.Lock()
+
+    @contextmanager
+    def timer(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - start)
+
+    def observe(self, name, seconds):
+        with self.lock:
+            timer = self.timers.setdefault(name, {"calls": 0, "seconds": 0.0, "max_seconds": 0.0})
+            timer["calls"] += 1
+            timer["seconds"] += seconds
+            timer["max_seconds"] = max(timer["max_seconds"], seconds)
+
+    def count(self, name, value=1):
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+
+    def report(self):
+        with self.lock:
+            return {
+                "timers": {name: dict(timer) for name, timer in self.timers.items()},
+                "counters": dict(self.counters)
+            }
+
+    def merge(self, report):
+        """Add a report of another Metrics, e.g. from a worker process."""
+        with self.lock:
+            for name, other in report["timers"].items():
+                timer = self.timers.setdefault(name, {"calls": 0, "seconds": 0.0, "max_seconds": 0.0})
+                timer["calls"] += other["calls"]
+                timer["seconds"] += other["seconds"]
+                timer["max_seconds"] = max(timer["max_seconds"], other["max_seconds"])
+            for name, value in report["counters"].items():
+                self.counters[name] = self.counters.get(name, 0) + value
+
+    def summary(self):
+        report = self.report()
+        lines = [f"{name}: {timer['calls']} calls, {timer['seconds']:.3f}s, "
+                 f"mean {1000 * timer['seconds'] / max(timer['calls'], 1):.3f}ms, max {1000 * timer['max_seconds']:.3f}ms"
+                 for name, timer in sorted(report["timers"].items())]
+        lines += [f"{name}: {value}" for name, value in sorted(report["counters"].items())]
+        return "\n".join(lines)
+
+    def to_json(self):
+        return json.dumps(self.report(), indent=2, sort_keys=True)
+
+    def to_prometheus(self, prefix="adaparser"):
+        report = self.report()
+        lines = []
+        if report["timers"]:
+            for metric, key, kind in (("stage_calls_total", "calls", "counter"),
+                                      ("stage_seconds_total", "seconds", "counter"),
+                                      ("stage_max_seconds", "max_seconds", "gauge")):
+                lines.append(f"# TYPE {prefix}_{metric} {kind}")
+                lines += [f'{prefix}_{metric}{{stage="{name}"}} {timer[key]}' for name, timer in sorted(report["timers"].items())]
+        for name, value in sorted(report["counters"].items()):
+            lines.append(f"# TYPE {prefix}_{name}_total counter")
+            lines.append(f"{prefix}_{name}_total {value}")
+        return "\n".join(lines) + "\n"
+
+    def export(self, path):
+        """Write the metrics to path, in the Prometheus text format for a .prom file and as JSON otherwise."""
+        with open(path, 'w') as fw:
+            fw.write(self.to_prometheus() if path.endswith('.prom') else self.to_json())
+
+
+def timed(name):
+    """Time a method with the Metrics in its object's metrics attribute, if any."""
+
+    def decorator(function):
+        @functools.wraps(function)
+        def wrapper(self, *args, **kwargs):
+            metrics = self.metrics
+            if metrics is None:
+                return function(self, *args, **kwargs)
+            with metrics.timer(name):
+                return function(self, *args, **kwargs)
+
+        return wrapper
+
+    return decorator
@@ -0,0 +1,109 @@
+import hashlib
+import json
+import logging
+import os
+import socketserver
+import threading
+import time
+
+from .AdaParser import pattern1
+
+logger = logging.getLogger(__name__)
+
+
+class OnlineParser:
+    """Parses log lines one at a time against the live trie of a LogParser.
+
+    Lines matched by a known template return immediately; only misses go
+    through the LLM path, and the trie is not locked while the LLM answers.
+    LogIDs are not recorded, so memory does not grow with the number of lines.
+    """
+
+    def __init__(self, parser, dataset_name):
+        self.parser = parser
+        self.candidates = parser.load_candidates(dataset_name)
+        self.templates = {}
+        self.lock = threading.Lock()
+
+    def template_of(self, event_template):
+        template = self.templates.get(event_template)
+        if template is None:
+            template_id = hashlib.md5(event_template.encode('utf-8')).hexdigest()[0:8]
+            template = self.templates[event_template] = (template_id, pattern1.sub("<*>", event_template))
+        return template
+
+    def parse_line(self, line):
+        logMessage = line.strip()
+        with self.lock:
+            stop_node, flag = self.parser.trie.search(logMessage)
+            if flag:
+                return self.template_of(stop_node.tokens)
+            self.parser.query_num += 1
+            logger.info("%s (query times: %d)", logMessage, self.parser.query_num, extra={"event": "query"})
+            messages = self.parser.build_messages(self.candidates, logMessage)
+
+        pred_template, flag = self.parser.query_template(logMessage, messages)
+
+        with self.lock:
+            stop_node, matched = self.parser.trie.search(logMessage)
+            if not matched:
+                self.parser.add_template(self.candidates, pred_template, flag, logMessage, stop_node, [])
+                stop_node, matched = self.parser.trie.search(logMessage)
+            return self.template_of(stop_node.tokens if matched else pred_template)
+
+    def parse_stream(self, lines, output):
+        for line in lines:
+            line = line.rstrip('\r\n')
+            output.write(format_record(line, *self.parse_line(line)))
+            output.flush()
+
+
+def format_record(line, event_id, event_template):
+    return json.dumps({"Content": line, "EventId": event_id, "EventTemplate": event_template}, ensure_ascii=False) + "\n"
+
+
+def follow(file_path, poll_interval=0.2, from_start=False):
+    """Yield lines appended to a file, like `tail -F`, reopening it when it is truncated or rotated."""
+    fr = open(file_path, 'r', encoding='utf-8', errors='replace')
+    if not from_start:
+        fr.seek(0, os.SEEK_END)
+    inode = os.fstat(fr.fileno()).st_ino
+    buffer = ""
+    while True:
+        line = fr.readline()
+        if line:
+            buffer += line
+            if buffer.endswith('\n'):
+                yield buffer
+                buffer = ""
+            continue
+        time.sleep(poll_interval)
+        try:
+            stat = os.stat(file_path)
+        except FileNotFoundError:
+            continue
+        if stat.st_ino != inode or stat.st_size < fr.tell():
+            fr.close()
+            fr = open(file_path, 'r', encoding='utf-8', errors='replace')
+            inode = os.fstat(fr.fileno()).st_ino
+            buffer = ""
+
+
+def serve(online_parser, host="127.0.0.1", port=9999):
+    """Serve a line protocol on a local TCP socket: each received log line is answered with one record."""
+
+    class Handler(socketserver.StreamRequestHandler):
+        def handle(self):
+            output = self.wfile
+            for line in self.rfile:
+                line = line.decode('utf-8', errors='replace').rstrip('\r\n')
+                output.write(format_record(line, *online_parser.parse_line(line)).encode('utf-8'))
+                output.flush()
+
+    class Server(socketserver.ThreadingMixIn, socketserver.TCPServer):
+        daemon_threads = True
+        allow_reuse_address = True
+
+    with Server((host, port), Handler) as server:
+        logger.info("Serving on %s:%s", host, port)
+        server.serve_forever()
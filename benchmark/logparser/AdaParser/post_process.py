@@ -6,6 +6,42 @@ param_regex = [
 ]
 
 
+# boolean = {}
+# default_strings = {}
+path_delimiters = {  # reduced set of delimiters for tokenizing for checking the path-like strings
+    r'\s', r'\,', r'\!', r'\;', r'\:',
+    r'\=', r'\|', r'\"', r'\'',
+    r'\[', r'\]', r'\(', r'\)', r'\{', r'\}'
+}
+token_delimiters = path_delimiters.union({  # all delimiters for tokenizing the remaining rules
+    r'\.', r'\-', r'\+', r'\@', r'\#', r'\$', r'\%', r'\&', r'\/'
+})
+
+# every regex is compiled once here instead of on every call
+double_space_regex = re.compile(r'\s+')
+token_regex = re.compile('[^' + ''.join(sorted(token_delimiters)) + ']+')  # a token is a run of non-delimiters
+digit_regex = re.compile(r'^\d+$')
+# Substitute consecutive variables only if separated with any delimiter including "." (DV)
+dot_variables_regex = re.compile(r'<\*>(?:\.<\*>)+')
+# Substitute consecutive variables only if not separated with any delimiter including space (CV)
+consecutive_variables_regex = re.compile(r'<\*>(?:<\*>)+')
+# each fixed-point `while ... in template: replace` loop becomes one substitution with the same result:
+# a separated variable chain collapses at once, and lookarounds let neighbouring matches share their spaces
+hash_variable_regexes = [re.compile(r'(?<= )#<\*>#(?= )'), re.compile(r'(?<= )#<\*>(?= )')]
+separated_variables_regexes = [re.compile(r'<\*>(?:' + re.escape(separator) + r'<\*>)+') for separator in ':#/@.']
+double_quoted_variable_regex = re.compile(r'(?<= )"<\*>"(?= )')
+single_quoted_variable_regex = re.compile(r"(?<= )'<\*>'(?= )")
+
+
+def correct_token(match):
+    token = match.group(0)
+    # apply DG
+    # apply WV (a token never contains whitespace or `/`, which are delimiters)
+    if "<*>" in token or digit_regex.match(token):
+        return '<*>'
+    return token
+
+
 def correct_single_template(template, user_strings=None):
     """Apply all rules to process a template.
 
@@ -20,23 +56,12 @@ def correct_single_template(template, user_strings=None):
 
     """
 
-    # boolean = {}
-    # default_strings = {}
-    path_delimiters = {  # reduced set of delimiters for tokenizing for checking the path-like strings
-        r'\s', r'\,', r'\!', r'\;', r'\:',
-        r'\=', r'\|', r'\"', r'\'',
-        r'\[', r'\]', r'\(', r'\)', r'\{', r'\}'
-    }
-    token_delimiters = path_delimiters.union({  # all delimiters for tokenizing the remaining rules
-        r'\.', r'\-', r'\+', r'\@', r'\#', r'\$', r'\%', r'\&', r'\/'
-    })
-
     # if user_strings:
     #     default_strings = default_strings.union(user_strings)
 
     # apply DS
     template = template.strip()
-    template = re.sub(r'\s+', ' ', template)
+    template = double_space_regex.sub(' ', template)
 
     # apply PS
     # p_tokens = re.split('(' + '|'.join(path_delimiters) + ')', template)
@@ -47,79 +72,28 @@ def correct_single_template(template, user_strings=None):
         # new_p_tokens.append(p_token)
     # template = ''.join(new_p_tokens)
 
-    # tokenize for the remaining rules
-    tokens = re.split('(' + '|'.join(token_delimiters) + ')', template)  # tokenizing while keeping delimiters
-    new_tokens = []
-
-    for token in tokens:
-        # apply BL, US
-        # for to_replace in boolean.union(default_strings):
-        #     if token.lower() == to_replace.lower():
-        #         token = '<*>'
-
-        # apply DG
-        if re.match(r'^\d+$', token):
-            token = '<*>'
-
-        # apply WV
-        if re.match(r'^[^\s\/]*<\*>[^\s\/]*$', token):
-            if token != '<*>/<*>':  # need to check this because `/` is not a deliminator
-                token = '<*>'
-
-        # collect the result
-        new_tokens.append(token)
+    # apply BL, US, DG and WV to every token while keeping delimiters
+    template = token_regex.sub(correct_token, template)
 
-    # make the template using new_tokens
-    template = ''.join(new_tokens)
+    template = dot_variables_regex.sub('<*>', template)
 
-    # Substitute consecutive variables only if separated with any delimiter including "." (DV)
-    while True:
-        prev = template
-        template = re.sub(r'<\*>\.<\*>', '<*>', template)
-        if prev == template:
-            break
-
-    # Substitute consecutive variables only if not separated with any delimiter including space (CV)
     # NOTE: this should be done at the end
-    #print("CV: ", template)
-    while True:
-        prev = template
-        template = re.sub(r'<\*><\*>', '<*>', template)
-        if prev == template:
-            break
-    #print("CV: ", template)
-
-    while " #<*># " in template:
-        template = template.replace(" #<*># ", " <*> ")
-
-    while " #<*> " in template:
-        template = template.replace(" #<*> ", " <*> ")
-
-    while "<*>:<*>" in template:
-        template = template.replace("<*>:<*>", "<*>")
-
-    while "<*>#<*>" in template:
-        template = template.replace("<*>#<*>", "<*>")
-
-    while "<*>/<*>" in template:
-        template = template.replace("<*>/<*>", "<*>")
+    template = consecutive_variables_regex.sub('<*>', template)
 
-    while "<*>@<*>" in template:
-        template = template.replace("<*>@<*>", "<*>")
+    for regex in hash_variable_regexes:
+        template = regex.sub('<*>', template)
 
-    while "<*>.<*>" in template:
-        template = template.replace("<*>.<*>", "<*>")
+    for regex in separated_variables_regexes:
+        template = regex.sub('<*>', template)
 
-    while ' "<*>" ' in template:
-        template = template.replace(' "<*>" ', ' <*> ')
+    template = double_quoted_variable_regex.sub('<*>', template)
 
+    # removing quotes can expose more quoted variables, e.g. `""<*>""`
     while '"<*>"' in template:
         template = template.replace('"<*>"', "<*>")
 
-    while " '<*>' " in template:
-        template = template.replace(" '<*>' ", " <*> ")
+    template = single_quoted_variable_regex.sub('<*>', template)
 
-    while "<*><*>" in template:
-        template = template.replace("<*><*>", "<*>")
+    template = consecutive_variables_regex.sub('<*>', template)
 
     return template
@@ -0,0 +1,50 @@
+from collections import Counter
+
+from .utils import lcs_length, message_split, token_masks
+
+
+def mask(tokens):
+    return tuple("<*>" if any(c.isdigit() for c in token) else token for token in tokens)
+
+
+class PreClusterer:
+    """Groups log messages that probably share a template, before any of them is sent to the LLM.
+
+    Like Drain, a message first descends a fixed-depth tree keyed by its first
+    `depth` tokens (tokens with digits masked), then joins the most similar
+    group of that leaf. Unlike Drain there is no token count level and the
+    similarity is the LCS of the masked tokens, so messages of a template with
+    a variable number of tokens still end up in one group.
+    """
+
+    def __init__(self, depth=2, similarity=0.6):
+        self.depth = depth
+        self.similarity = similarity
+
+    def group(self, pending):
+        """Groups of (logMessage, logIDs) pairs, in the order of their first message."""
+        leaves = {}
+        groups = []
+        for item in pending:
+            tokens = mask(message_split(item[0]))
+            best, best_similarity = None, self.similarity
+            for group in leaves.setdefault(tokens[:self.depth], []):
+                seed, masks = group["seed"], group["masks"]
+                similarity = 2 * lcs_length(masks, len(seed), tokens) / max(len(seed) + len(tokens), 1)
+                if similarity >= best_similarity:
+                    best, best_similarity = group, similarity
+            if best is None:
+                best = {"seed": tokens, "masks": token_masks(tokens), "members": []}
+                leaves[tokens[:self.depth]].append(best)
+                groups.append(best)
+            best["members"].append((item, tokens))
+        return [[item for item, _ in group["members"]] for group in groups]
+
+    @staticmethod
+    def representative(group):
+        """The message whose tokens are the most common in its group, the first one on ties."""
+        tokens = [mask(message_split(logMessage)) for logMessage, _ in group]
+        frequency = Counter(token for message_tokens in tokens for token in set(message_tokens))
+        scores = [sum(frequency[token] for token in message_tokens) / len(message_tokens) if message_tokens else 0
+                  for message_tokens in tokens]
+        return group[scores.index(max(scores))][0]
@@ -0,0 +1,53 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+
+
+class ResponseCache:
+    """SQLite cache of LLM responses, keyed by model, temperature, seed and the full messages list.
+
+    The token usage of the original call is stored with the text, so a cached
+    answer is accounted for exactly as the call that produced it.
+    """
+
+    def __init__(self, path):
+        directory = os.path.dirname(path)
+        if directory and not os.path.exists(directory):
+            os.makedirs(directory)
+        self.path = path
+        self.lock = threading.Lock()
+        self.connection = sqlite3.connect(path, timeout=60, check_same_thread=False)
+        self.connection.execute("CREATE TABLE IF NOT EXISTS responses ("
+                                "key TEXT PRIMARY KEY, response TEXT, prompt_tokens INTEGER, completion_tokens INTEGER)")
+        self.connection.commit()
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def make_key(model, temperature, seed, messages):
+        payload = json.dumps([model, temperature, seed, messages], sort_keys=True, ensure_ascii=False)
+        return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+    def get(self, model, temperature, seed, messages):
+        key = self.make_key(model, temperature, seed, messages)
+        with self.lock:
+            row = self.connection.execute("SELECT response, prompt_tokens, completion_tokens FROM responses WHERE key = ?",
+                                          (key,)).fetchone()
+            if row is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        return row
+
+    def put(self, model, temperature, seed, messages, response, prompt_tokens, completion_tokens):
+        key = self.make_key(model, temperature, seed, messages)
+        with self.lock:
+            self.connection.execute("INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?)",
+                                    (key, response, prompt_tokens, completion_tokens))
+            self.connection.commit()
+
+    def close(self):
+        with self.lock:
+            self.connection.close()
@@ -0,0 +1,88 @@
+import logging
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+
+from .preclustering import PreClusterer
+from .utils import post_process_template
+
+logger = logging.getLogger(__name__)
+
+
+class QueryScheduler:
+    """Buffers messages missed by the trie and queries the LLM for them concurrently.
+
+    Buffered messages are clustered by their heuristic template, or with a
+    PreClusterer, so that only one representative per cluster is sent; the
+    other messages of a cluster take its template if the template matches
+    them. Answers are reconciled into the trie in logID order, so the result
+    does not depend on which request finishes first.
+    """
+
+    def __init__(self, parser, candidates, window=64, concurrency=4, batch_size=1, preclusterer=None):
+        self.parser = parser
+        self.candidates = candidates
+        self.window = window
+        self.concurrency = concurrency
+        self.batch_size = batch_size
+        self.preclusterer = preclusterer
+        self.pending = []
+
+    def submit(self, logMessage, logIDs):
+        self.pending.append((logMessage, logIDs))
+        if len(self.pending) >= self.window:
+            self.flush()
+
+    def cluster(self, pending):
+        """Clusters of (logMessage, logIDs) pairs and the representative of each."""
+        if self.preclusterer is not None:
+            groups = self.preclusterer.group(pending)
+            return [(self.preclusterer.representative(group), group) for group in groups]
+        clusters = defaultdict(list)
+        for logMessage, logIDs in pending:
+            template, _ = post_process_template(logMessage)
+            clusters[template].append((logMessage, logIDs))
+        return [(group[0][0], group) for group in clusters.values()]
+
+    def query(self, representatives):
+        for logMessage in representatives:
+            self.parser.query_num += 1
+            logger.info("%s (query times: %d)", logMessage, self.parser.query_num, extra={"event": "query"})
+        with ThreadPoolExecutor(max_workers=self.concurrency) as executor:
+            if self.batch_size > 1:
+                # several representatives per prompt
+                batches = [representatives[i:i + self.batch_size] for i in range(0, len(representatives), self.batch_size)]
+                results = [result for batch in executor.map(lambda batch: self.parser.query_batch(self.candidates, batch), batches)
+                           for result in batch]
+            else:
+                requests = [(logMessage, self.parser.build_messages(self.candidates, logMessage)) for logMessage in representatives]
+                results = list(executor.map(lambda request: self.parser.query_template(*request), requests))
+        return dict(zip(representatives, results))
+
+    def flush(self):
+        pending, self.pending = self.pending, []
+        while pending:
+            clusters = self.cluster(pending)
+            answers = self.query([representative for representative, _ in clusters])
+            # the members a representative's template matches need no query of their own
+            covered = {}
+            for representative, group in clusters:
+                pred_template, flag = answers[representative]
+                for logMessage, _ in group:
+                    if logMessage != representative and flag and self.parser.match_template(pred_template, logMessage):
+                        covered[logMessage] = pred_template
+            self.parser.metrics.count("precluster_covered", len(covered))
+            unmatched = []
+            # representatives first, so their answers become examples even if a member ahead of them is covered
+            for logMessage, logIDs in sorted(pending, key=lambda item: item[0] not in answers):
+                stop_node, flag = self.parser.trie.search(logMessage)
+                if flag:
+                    stop_node.logIDs.extend(logIDs)
+                elif logMessage in answers:
+                    pred_template, flag = answers[logMessage]
+                    self.parser.add_template(self.candidates, pred_template, flag, logMessage, stop_node, logIDs)
+                elif logMessage in covered:
+                    self.parser.trie.update(covered[logMessage], stop_node, logIDs)
+                else:
+                    # the representative's template does not cover it, query it in the next round
+                    unmatched.append((logMessage, logIDs))
+            pending = unmatched
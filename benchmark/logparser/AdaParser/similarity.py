@@ -0,0 +1,41 @@
+import heapq
+
+from .utils import lcs_length, string_split, token_masks
+
+
+class SimilarityEngine:
+    """LCS similarity of one query against many texts.
+
+    Texts that are compared again and again (candidates, templates) are
+    tokenized once and kept as tuples of token IDs; the query is turned into
+    bit masks once per call and every text is scored with the bit-parallel LCS.
+    """
+
+    def __init__(self):
+        self.token_ids = {}
+        self.sequences = {}
+
+    def encode(self, text):
+        sequence = self.sequences.get(text)
+        if sequence is None:
+            token_ids = self.token_ids
+            sequence = tuple(token_ids.setdefault(token, len(token_ids)) for token in string_split(text))
+            self.sequences[text] = sequence
+        return sequence
+
+    def query_masks(self, query):
+        # tokens that no cached text contains can never match, they only count towards the length
+        tokens = string_split(query)
+        token_ids = self.token_ids
+        return token_masks(token_ids.get(token, -1) for token in tokens), len(tokens)
+
+    def similarities(self, query, texts):
+        sequences = [self.encode(text) for text in texts]
+        masks, length = self.query_masks(query)
+        return [2 * lcs_length(masks, length, sequence) / (length + len(sequence)) for sequence in sequences]
+
+    def top_k(self, query, examples, k, key="query"):
+        """Return the k examples most similar to the query, least similar first; ties go to later examples."""
+        similarities = self.similarities(query, [example[key] for example in examples])
+        indices = heapq.nlargest(k, range(len(examples)), key=lambda i: (similarities[i], i))
+        return [examples[i] for i in reversed(indices)]
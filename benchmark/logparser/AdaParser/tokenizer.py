@@ -0,0 +1,55 @@
+import sys
+import threading
+from collections import OrderedDict
+
+from .utils import post_process_tokens, string_split
+
+
+class Tokenizer:
+    """Splits templates and log messages into trie tokens.
+
+    The same few thousand templates are split on every insert, delete and
+    update, so their tokens are kept in an LRU cache. All tokens are interned,
+    so looking them up among the trie children compares identical strings.
+    """
+
+    def __init__(self, maxsize=4096):
+        self.maxsize = maxsize
+        self.cache = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+
+    @staticmethod
+    def tokenize(text):
+        return tuple(sys.intern(token) for token in post_process_tokens(string_split(text)))
+
+    def split(self, template):
+        """Tokens of a template, from the cache when it was split recently."""
+        with self.lock:
+            tokens = self.cache.get(template)
+            if tokens is not None:
+                self.hits += 1
+                self.cache.move_to_end(template)
+                return tokens
+            self.misses += 1
+        tokens = self.tokenize(template)
+        with self.lock:
+            self.cache[template] = tokens
+            if len(self.cache) > self.maxsize:
+                self.cache.popitem(last=False)
+        return tokens
+
+    def split_messages(self, messages):
+        """Tokens of every message of a column (any iterable, e.g. a pandas Series), each distinct message split once.
+
+        Log messages are not cached, they would only push the templates out.
+        """
+        splits = {}
+        result = []
+        for message in messages:
+            tokens = splits.get(message)
+            if tokens is None:
+                tokens = splits[message] = self.tokenize(message)
+            result.append(tokens)
+        return result
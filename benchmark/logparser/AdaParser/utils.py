@@ -1,16 +1,25 @@
+import functools
 import json
 import logging
+import os
 import re
 import string
+import threading
 import time
 
-import openai
-from dateutil import parser
-from openai import OpenAI
-
+from .llm_client import LLMCallError, backoff_delay, retry_after
 from .post_process import correct_single_template
 
-logging.basicConfig(level=logging.WARNING, format='%(asctime)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+package_dir = os.path.dirname(os.path.abspath(__file__))
+# the repository root, where openai_key.txt and full_dataset/ live
+root_dir = os.path.normpath(os.path.join(package_dir, "..", "..", ".."))
+openai_key_path = os.path.join(root_dir, "openai_key.txt")
+
+client_lock = threading.Lock()
+openai_client = None
+
 
 def get_openai_key(file_path):
     with open(file_path, 'r') as file:
@@ -18,22 +27,38 @@ def get_openai_key(file_path):
         base_url = file.readline().strip()
     return api_key, base_url
 
-api_key, base_url = get_openai_key('../../openai_key.txt')
-print(api_key)
-print(base_url)
-
-client = OpenAI(
-    api_key=api_key,
-    base_url=base_url,
-    max_retries=0
-)
 
-regs_common = []
-with open("../logparser/AdaParser/common.json") as fr:
-    dic = json.load(fr)
-patterns = dic['COMMON']['regex']
-for pattern in patterns:
-    regs_common.append(re.compile(pattern))
+def default_client():
+    """The OpenAI client used when none is passed, created on the first LLM call.
+
+    The key and the base url come from openai_key.txt at the repository root
+    if it exists, otherwise from the OPENAI_API_KEY and OPENAI_BASE_URL
+    environment variables. All threads share its pool of keep-alive
+    connections; retries are left to gpt_call.
+    """
+    global openai_client
+    with client_lock:
+        if openai_client is None:
+            import httpx
+            from openai import OpenAI
+            api_key, base_url = get_openai_key(openai_key_path) if os.path.exists(openai_key_path) else (None, None)
+            logger.debug("OpenAI base url: %s", base_url)
+            http_client = httpx.Client(limits=httpx.Limits(max_connections=64, max_keepalive_connections=32, keepalive_expiry=60),
+                                       timeout=httpx.Timeout(120, connect=10))
+            openai_client = OpenAI(api_key=api_key, base_url=base_url or None, max_retries=0, http_client=http_client)
+        return openai_client
+
+
+@functools.lru_cache(maxsize=None)
+def common_regexes():
+    with open(os.path.join(package_dir, "common.json")) as fr:
+        dic = json.load(fr)
+    regs_common = []
+    for pattern in dic['COMMON']['regex']:
+        # "start or after a non-alphanumeric" (and its mirror) as one lookaround matches the same spans but scans faster
+        pattern = pattern.replace("((?<=[^A-Za-z0-9])|^)", "(?<![A-Za-z0-9])").replace("((?=[^A-Za-z0-9])|$)", "(?![A-Za-z0-9])")
+        regs_common.append(re.compile(pattern))
+    return regs_common
 
 compiled_pattern1 = re.compile(r"\{\w+}")
 punc = "!\"#$%&'()+,-./:;=?[]^_`{|}~@"
@@ -43,30 +68,18 @@ complied_pattern3 = re.compile(r"^[A-Z_]+$")
 excluded_str = {'=', '|', '(', ')', ':', '/'}
 translation_table = str.maketrans('', '', ''.join(set(punc) - excluded_str))
 lower_camel = re.compile(r'^[a-z]+([A-Z][a-z]*)*$')
+static_table = str.maketrans('', '', string.punctuation + ' ')
 
 
 def post_process_template(template):
     template = compiled_pattern1.sub("<*>", template)
-    for reg in regs_common:
+    for reg in common_regexes():
         template = reg.sub("<*>", template)
     template = correct_single_template(template)
-    static_part = template.replace("<*>", "")
-    punc = string.punctuation
-    for s in static_part:
-        if s != ' ' and s not in punc:
-            template = template.replace("<*>", "{variables}")
-            return template, True
-    # print("Get a too general template. Error.")
+    # the template is too general if its static part has nothing but punctuation and spaces
+    static_part = template.replace("<*>", "").translate(static_table)
     template = template.replace("<*>", "{variables}")
-    return template, False
-
-
-def is_datetime_string(s):
-    try:
-        parser.parse(s)
-        return True
-    except (ValueError, OverflowError):
-        return False
+    return template, bool(static_part)
 
 
 def is_camel_case(s):
@@ -82,24 +95,60 @@ def read_json_file(file_path):
     return data
 
 
-def gpt_call(message, model="gpt-3.5-turbo-0125", max_retries=100, temperature=0.0):
-    for i in range(max_retries):
+retryable_status_codes = {408, 409, 429}
+
+
+def gpt_call(message, model="gpt-3.5-turbo-0125", max_retries=10, temperature=0.0, client=None, cache=None, seed=0,
+             rate_limiter=None):
+    """The response text and token usage of a chat completion.
+
+    Timeouts, connection errors, rate limits, server errors and malformed
+    responses are retried with exponential backoff and jitter, waiting at
+    least as long as a Retry-After header asks. Raises LLMCallError when the
+    request is rejected or the retries are exhausted.
+    """
+    if cache is not None:
+        cached = cache.get(model, temperature, seed, message)
+        if cached is not None:
+            return cached
+    import openai
+    if client is None:
+        client = default_client()
+    for attempt in range(max_retries):
+        estimated = rate_limiter.acquire(message) if rate_limiter is not None else 0
+        wait = None
         try:
             result = client.chat.completions.create(
                 model=model,
                 messages=message,
                 temperature=temperature,
-                seed=0
+                seed=seed
             )
-            prompt_tokens = result.usage.prompt_tokens
-            completion_tokens = result.usage.completion_tokens
-            res = result.choices[0].message.content
-            return res, prompt_tokens, completion_tokens
-        except (openai.APITimeoutError, openai.InternalServerError, openai.APIConnectionError, openai.APIStatusError, TypeError) as e:
-            logging.warning(f"Retry {i + 1}/{max_retries}: {e}")
-            time.sleep(1)
-    logging.error("Exceeded maximum retry number")
-    return None
+        except (openai.APITimeoutError, openai.APIConnectionError) as e:
+            error = e
+        except openai.APIStatusError as e:
+            if e.status_code not in retryable_status_codes and e.status_code < 500:
+                raise LLMCallError(f"LLM request rejected: {e}", attempt + 1, e.status_code) from e
+            error, wait = e, retry_after(e)
+        else:
+            try:
+                prompt_tokens = result.usage.prompt_tokens
+                completion_tokens = result.usage.completion_tokens
+                res = result.choices[0].message.content
+            except (AttributeError, IndexError, TypeError) as e:
+                error = e
+            else:
+                if rate_limiter is not None:
+                    rate_limiter.settle(estimated, prompt_tokens + completion_tokens)
+                if cache is not None:
+                    cache.put(model, temperature, seed, message, res, prompt_tokens, completion_tokens)
+                return res, prompt_tokens, completion_tokens
+        if attempt + 1 == max_retries:
+            raise LLMCallError(f"LLM call failed after {max_retries} attempts: {error}", max_retries,
+                               getattr(error, "status_code", None)) from error
+        delay = backoff_delay(attempt, wait=wait)
+        logger.warning("Retry %d/%d in %.1fs: %s", attempt + 1, max_retries, delay, error, extra={"event": "retry"})
+        time.sleep(delay)
 
 
 def custom_key(key):
@@ -133,34 +182,28 @@ def string_split(tokens):
     return tokens
 
 
+def token_masks(tokens):
+    masks = {}
+    for i, token in enumerate(tokens):
+        masks[token] = masks.get(token, 0) | (1 << i)
+    return masks
+
+
+def lcs_length(masks, length, tokens):
+    """Length of the longest common subsequence, computed bit-parallel (Hyyro, 2004).
+
+    masks holds, for each token of the first sequence, the bit set of its positions.
+    """
+    full = (1 << length) - 1
+    v = full
+    for token in tokens:
+        u = v & masks.get(token, 0)
+        v = ((v + u) | (v - u)) & full
+    return length - bin(v).count("1")
+
+
 def LCS_similarity(t1, t2):
     t1 = string_split(t1)
     t2 = string_split(t2)
-
-    def lcs(X, Y):
-        m = len(X)
-        n = len(Y)
-        dp = [[0] * (n + 1) for _ in range(m + 1)]
-        for i in range(m + 1):
-            for j in range(n + 1):
-                if i == 0 or j == 0:
-                    dp[i][j] = 0
-                elif X[i - 1] == Y[j - 1]:
-                    dp[i][j] = dp[i - 1][j - 1] + 1
-                else:
-                    dp[i][j] = max(dp[i - 1][j], dp[i][j - 1])
-        lcs = []
-        i, j = m, n
-        while i > 0 and j > 0:
-            if X[i - 1] == Y[j - 1]:
-                lcs.insert(0, X[i - 1])
-                i -= 1
-                j -= 1
-            elif dp[i - 1][j] > dp[i][j - 1]:
-                i -= 1
-            else:
-                j -= 1
-        return lcs
-
-    similarity = 2 * len(lcs(t1, t2)) / (len(t1) + len(t2))
+    similarity = 2 * lcs_length(token_masks(t1), len(t1), t2) / (len(t1) + len(t2))
     return similarity